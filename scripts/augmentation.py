@@ -9,6 +9,8 @@ sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
 import random
 from data_bunch import *
 
+BILINEAR = 2 # PIL.Image.BILINEAR, spelled out so PIL is only imported once images are used
+
 def get_image_list(transforms):
     '''Util function for getting image list from path with optional transformation.
         transforms: list of transformation functions for data
@@ -90,7 +92,7 @@ def default_crop_size(w, h):
     return [w, w] if w < h else [h, h]
 
 class GeneralCrop(PilTransform):
-    def __init__(self, size, crop_size=None, resample=PIL.Image.BILINEAR):
+    def __init__(self, size, crop_size=None, resample=BILINEAR):
         '''General crop transformation class.
             size: image size
             crop_size: desired crop size (maximum square by default)
@@ -109,7 +111,7 @@ class GeneralCrop(PilTransform):
     def get_corners(self, w, h): return (0, 0, w, h)
 
 class CenterCrop(GeneralCrop):
-    def __init__(self, size, scale=1.14, resample=PIL.Image.BILINEAR):
+    def __init__(self, size, scale=1.14, resample=BILINEAR):
         '''Center crop transformation class.
             size: image size
             scale: cropping scale
@@ -125,7 +127,7 @@ class CenterCrop(GeneralCrop):
         return ((w-wc)//2, (h-hc)//2, (w-wc)//2+wc, (h-hc)//2+hc)
 
 class RandomResizedCrop(GeneralCrop):
-    def __init__(self, size, scale=(0.08, 1.0), ratio=(3./4., 4./3.), resample=PIL.Image.BILINEAR):
+    def __init__(self, size, scale=(0.08, 1.0), ratio=(3./4., 4./3.), resample=BILINEAR):
         '''Randomized crop transformation class (common used on ImageNet data).
             size: image size
             scale: uniform distribution boundary for sampling scale
@@ -174,7 +176,7 @@ def find_coeffs(src, tar):
     B = FloatTensor(src).view(8, 1)
     return list(torch.solve(B, A)[0][:, 0])
 
-def warp(img, size, src, resample=PIL.Image.BILINEAR):
+def warp(img, size, src, resample=BILINEAR):
     '''Warp image by source coordinates and size.
         img: input image data
         size: image size
@@ -194,7 +196,7 @@ def uniform(a, b):
     return a + (b-a)*random.random()
 
 class WarpRandomCrop(PilTransform):
-    def __init__(self, size, crop_size=None, magnitude=0., resample=PIL.Image.BILINEAR):
+    def __init__(self, size, crop_size=None, magnitude=0., resample=BILINEAR):
         '''Random Warp transformation class.
             size: image size
             crop_size: cropping size
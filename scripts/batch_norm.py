@@ -16,6 +16,18 @@ def weighted_sum(t1, t2, ratio):
     '''
     return t1 * ratio + t2 * (1 - ratio)
 
+class frozen_stats():
+    active = False # shared by every batch norm layer
+
+    def __init__(self):
+        '''Context manager in which batch norm layers don't update their running statistics (recomputed forward of checkpoints).'''
+
+    def __enter__(self):
+        self.prev, frozen_stats.active = frozen_stats.active, True
+
+    def __exit__(self, *args):
+        frozen_stats.active = self.prev
+
 class BatchNorm(Module):
     def __init__(self, c, momentum=0.1, epsilon=1e-6):
         '''Batch normalization layer.
@@ -33,35 +45,43 @@ class BatchNorm(Module):
         self.beta  = Parameter(torch.zeros(1,c,1,1))
 
     def update_stats(self, inp):
-        mean = inp.mean((0,2,3), keepdim=True)
-        var =  inp.var ((0,2,3), keepdim=True)
-        self.mean = weighted_sum(self.mean, mean, self.momentum)
-        self.var = weighted_sum(self.var, var, self.momentum)
+        # batch mean and (biased) variance in a single pass over the input
+        var, mean = torch.var_mean(inp, (0,2,3), unbiased=False, keepdim=True)
+        if not frozen_stats.active:
+            # running statistics are updated in place (same weighted sum as weighted_sum), running variance is unbiased
+            n = inp.numel() // inp.shape[1]
+            self.mean.lerp_(mean, 1 - self.momentum)
+            self.var.lerp_(var * (n / max(n - 1, 1)), 1 - self.momentum)
         return mean, var
 
     def fwd(self, inp):
+        if not use_batch_stats():
+            # inference: normalize with running statistics, nothing is cached
+            self.x_hat = self.inv_std = None
+            scale = self.gamma.data * (self.var + self.epsilon).rsqrt()
+            return torch.addcmul(self.beta.data - self.mean * scale, inp, scale, out=self.buffer('out', inp.shape))
         mean, var = self.update_stats(inp)
-        self.x_hat = (inp - mean) / (var + self.epsilon).sqrt()
-        return self.gamma.data * self.x_hat + self.beta.data
+        inv_std = (var + self.epsilon).rsqrt()
+        x_hat = (inp - mean).mul_(inv_std)
+        # centered input (normalized) and inverse std of the batch are all bwd needs
+        self.x_hat, self.inv_std = (x_hat, inv_std) if grad_enabled() else (None, None)
+        return torch.addcmul(self.beta.data, self.gamma.data, x_hat, out=self.buffer('out', inp.shape))
 
     def bwd(self, out, inp):
-        # learned from: https://kratzert.github.io/2016/02/12/understanding-the-gradient-flow-through-the-batch-normalization-layer.html
         dL = out.g
         dLdg = (dL * self.x_hat).sum((0,2,3), keepdim=True)
         dLdb = dL.sum((0,2,3), keepdim=True)
         self.gamma.update(dLdg)
         self.beta.update(dLdb)
 
-        n = dL.shape[0]
-        dLdx = dL * self.gamma.data
-
-        denom = (self.var + self.epsilon).sqrt()
-        numer = inp - self.mean
-
-        dv = (-1/2)*dLdx*numer / (self.var+self.epsilon)**1.5
-        dm = ( 2/n)*dLdx/denom + numer*dv
+        # closed form: dx = gamma * inv_std * (dL - mean(dL) - x_hat * mean(dL * x_hat)), means over (0,2,3)
+        n = dL.numel() // dL.shape[1]
+        dLdx = torch.mul(self.x_hat, dLdg / n, out=self.buffer('grad', inp.shape))
+        inp.g = dLdx.neg_().add_(dL).sub_(dLdb / n).mul_(self.gamma.data * self.inv_std)
 
-        inp.g = (2*dv*numer + dm)/n + dLdx/denom
+    def free(self):
+        super().free()
+        self.x_hat = self.inv_std = None
 
     def __repr__(self, t=''):
         return f"{t+'    '}BatchNorm()"
@@ -0,0 +1,84 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/33_bn_folding.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from memory_plan import *
+import copy
+
+def fold_batch_norm(layer, bn):
+    '''Fold the running statistics and affine parameters of a batch norm layer into the preceding conv or linear layer (in place).
+        layer: conv or linear layer followed by bn
+        bn: batch norm layer
+    '''
+    scale = (bn.gamma.data / (bn.var + bn.epsilon).sqrt()).view(-1)
+    shift = bn.beta.data.view(-1) - bn.mean.view(-1) * scale
+    # conv weights are (c_out, c_in, k_s, k_s), linear weights are (in_dim, num_hidden)
+    w_scale = scale.view(-1, 1, 1, 1) if isinstance(layer, Conv) else scale
+    layer.w.data.mul_(w_scale)
+    layer.b.data.mul_(scale.view_as(layer.b.data)).add_(shift.view_as(layer.b.data))
+
+def fold_conv_bn_relu(layer):
+    '''Layers replacing a fused ConvBNReLU: its conv with the batch norm folded in, followed by a ReLU if it had one.
+        layer: ConvBNReLU layer
+    '''
+    fold_batch_norm(layer.conv, layer.bn)
+    return [layer.conv, ReLU()] if layer.relu else [layer.conv]
+
+def fold_layers(model):
+    '''Fold every batch norm layer that directly follows a conv or linear layer in a model tree (in place), returns the number of folded layers.
+        model: Sequential model or layer (sub models, checkpoints and res layers are walked into, fused ConvBNReLU layers are split)
+    '''
+    # planned buffers were sized for the unfolded model
+    if isinstance(model, Module): model.buffers = {}
+    num_folded = 0
+    if isinstance(model, Sequential):
+        layers = []
+        for layer in model.layers:
+            if isinstance(layer, BatchNorm) and layers and isinstance(layers[-1], (Conv, Linear)):
+                fold_batch_norm(layers[-1], layer)
+                num_folded += 1
+            elif isinstance(layer, ConvBNReLU):
+                layers += fold_conv_bn_relu(layer)
+                num_folded += 1
+            else:
+                num_folded += fold_layers(layer)
+                layers.append(layer)
+        model.layers = layers
+    else:
+        for name, child in list(vars(model).items()):
+            if isinstance(child, ConvBNReLU):
+                setattr(model, name, Sequential(fold_conv_bn_relu(child)))
+                num_folded += 1
+            elif isinstance(child, (Sequential, Module)): num_folded += fold_layers(child)
+    return num_folded
+
+def root_sequential(model):
+    '''Sequential that sets the mode of a model, a SubModel root (ex. ResNet) runs in the mode of its sub model.
+        model: Sequential model or SubModel
+    '''
+    while isinstance(model, SubModel): model = model.sub_model
+    return model
+
+def fold_batch_norms(model, inp=None, verbose=True):
+    '''Equivalent but shorter copy of a model for inference, batch norm layers following conv or linear layers are folded into them.
+        model: Sequential model or SubModel (ex. ResNet), left unchanged
+        inp: input batch to verify that the folded model gives the same output
+        verbose: whether to report the number of folded layers
+    '''
+    folded = copy.deepcopy(model)
+    root_sequential(folded).eval_()
+    num_folded = fold_layers(folded)
+    if verbose: print(f'folded {num_folded} batch norm layers')
+    if inp is not None:
+        root = root_sequential(model)
+        training = root.training
+        root.eval_()
+        out, folded_out = model(inp), folded(inp)
+        root.training = training
+        if verbose: print(f'max output difference: {(out - folded_out).abs().max():.2e}')
+        test_near(out, folded_out)
+    return folded
\ No newline at end of file
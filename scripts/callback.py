@@ -21,6 +21,10 @@ def camel2snake(name):
 
 class Callback():
     order = 0
+    # events the learners fire, methods with other names are never called as hooks
+    EVENTS = ('before_fit', 'before_epoch', 'before_train', 'before_batch', 'after_pred', 'after_loss', 'after_loss_back',
+              'after_model_back', 'after_step', 'after_cancel_batch', 'after_batch', 'after_cancel_epoch', 'before_valid',
+              'after_epoch', 'after_cancel_train', 'after_fit')
 
     def __init__(self):
         '''Callback class with order.'''
@@ -52,8 +52,40 @@ class Flatten(Module):
     def __repr__(self, t=''):
         return f"{t+'    '}Flatten()"
 
+def im2col(inp, k_s, stride):
+    '''Unfold every receptive field of inp into a column (batch, c * k_s * k_s, out_h * out_w).
+        inp: (padded) input data
+        k_s: square kernel size
+        stride: stride size
+    '''
+    batch_size, c, _, _ = inp.shape
+    # strided window view (batch, c, out_h, out_w, k_s, k_s), no copy until reshape
+    windows = inp.unfold(2, k_s, stride).unfold(3, k_s, stride)
+    out_h, out_w = windows.shape[2:4]
+    cols = windows.permute(0, 1, 4, 5, 2, 3).reshape(batch_size, c * k_s * k_s, out_h * out_w)
+    return cols, out_h, out_w
+
+def col2im(cols, shape, k_s, stride, out_h, out_w, out=None):
+    '''Fold columns back into an input shaped tensor, summing overlapping receptive fields (reverse of im2col).
+        cols: columns of shape (batch, c * k_s * k_s, out_h * out_w)
+        shape: (padded) input shape
+        k_s: square kernel size
+        stride: stride size
+        out_h: output height
+        out_w: output width
+        out: tensor to write the result into (default to a new tensor)
+    '''
+    batch_size, c, _, _ = shape
+    cols = cols.view(batch_size, c, k_s, k_s, out_h, out_w)
+    out = torch.zeros(shape, out=out)
+    # loop over kernel offsets only (k_s * k_s iterations), each one covers all output cells
+    for i in range(k_s):
+        for j in range(k_s):
+            out[:, :, i: i+stride*out_h: stride, j: j+stride*out_w: stride] += cols[:, :, i, j]
+    return out
+
 class Conv(Module):
-    def __init__(self, c_in, c_out, k_s=3, stride=1, pad=0, leak=1.):
+    def __init__(self, c_in, c_out, k_s=3, stride=1, pad=0, leak=1., im2col=True):
         '''Convolutional layer.
             c_in: channel in
             c_out: channel out
@@ -61,6 +93,7 @@ class Conv(Module):
             stride: stride size
             pad: padding size
             leak: initialization parameter
+            im2col: whether to compute with batched matmuls over unfolded input (else reference cell by cell loop)
         '''
         super().__init__()
         self.c_in = c_in
@@ -68,11 +101,42 @@ class Conv(Module):
         self.k_s = k_s
         self.stride = stride
         self.pad = pad
+        self.im2col = im2col
 
         self.w = Parameter(init_4d_weight((c_out, c_in, k_s, k_s), leak))
         self.b = Parameter(torch.zeros(c_out))
 
     def fwd(self, inp):
+        return self.fwd_im2col(inp) if self.im2col else self.fwd_loop(inp)
+
+    def bwd(self, out, inp):
+        return self.bwd_im2col(out, inp) if self.im2col else self.bwd_loop(out, inp)
+
+    def fwd_im2col(self, inp):
+        batch_size = inp.shape[0]
+        cols, out_h, out_w = im2col(pad_tensor(inp, self.pad), self.k_s, self.stride)
+
+        # (c_out, c_in*k_s*k_s) @ (batch, c_in*k_s*k_s, out_h*out_w) -> (batch, c_out, out_h*out_w)
+        out = self.buffer('out', (batch_size, self.c_out, out_h, out_w))
+        out = torch.matmul(self.w.data.view(self.c_out, -1), cols, out=None if out is None else out.view(batch_size, self.c_out, -1))
+        return out.add_(self.b.data[:, None]).view(batch_size, self.c_out, out_h, out_w)
+
+    def bwd_im2col(self, out, inp):
+        X = pad_tensor(inp, self.pad)
+        # recompute columns instead of caching them (they are k_s * k_s times larger than input)
+        cols, out_h, out_w = im2col(X, self.k_s, self.stride)
+        dL = out.g.reshape(out.g.shape[0], self.c_out, -1)
+        F = self.w.data.view(self.c_out, -1)
+
+        dF = (dL @ cols.transpose(1, 2)).sum(0)
+        dB = dL.sum((0, 2))
+        dX = col2im(F.t() @ dL, X.shape, self.k_s, self.stride, out_h, out_w, self.buffer('grad', X.shape))
+
+        self.w.update(dF.view_as(self.w.data))
+        self.b.update(dB)
+        inp.g = dX if self.pad == 0 else dX[:, :, self.pad: -self.pad, self.pad: -self.pad]
+
+    def fwd_loop(self, inp):
         batch_size, _, in_h, in_w = inp.shape
         inp = pad_tensor(inp, self.pad)
         _, _, p_h, p_w = inp.shape
@@ -89,7 +153,7 @@ class Conv(Module):
 
         return out
 
-    def bwd(self, out, inp):
+    def bwd_loop(self, out, inp):
         # source of var names and math calcs: https://medium.com/@pavisj/convolutions-and-backpropagations-46026a8f5d2c
         dL = out.g
         X, F, B = pad_tensor(inp, self.pad), self.w.data, self.b.data
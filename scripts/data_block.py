@@ -7,12 +7,13 @@ import sys
 sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
 
 from typing import *
-import PIL
 import mimetypes
 from functools import partial
 from pathlib import Path
 from parameter import *
 
+PIL = LazyModule('PIL')
+
 Path.ls = lambda x: list(x.iterdir())
 
 image_exts = set(k for k,v in mimetypes.types_map.items() if v.startswith('image/'))
@@ -86,7 +87,7 @@ class ListContainer():
 
     def __getitem__(self, idx):
         if isinstance(idx, torch.Tensor):
-            idx = int(idx.item())
+            idx = int(idx.item()) if idx.ndim == 0 else idx.tolist()
         if isinstance(idx, (int, slice)):
             return self.items[idx]
         if isinstance(idx[0], bool):
@@ -130,6 +131,7 @@ class ItemList(ListContainer):
         super().__init__(items)
         self.path = Path(path)
         self.transforms = transforms
+        self.items_tensor = None
 
     def new(self, items, cls=None):
         cls = cls if cls else self.__class__
@@ -145,6 +147,21 @@ class ItemList(ListContainer):
             return [self._get(o) for o in items]
         return self._get(items)
 
+    def get_batch(self, idxs):
+        # untransformed numbers (ex. labels) are gathered from a cached tensor, other items are stacked
+        if not self.transforms and isinstance(self.items[0], (int, float)):
+            if self.items_tensor is None: self.items_tensor = tensor(self.items)
+            return self.items_tensor[idxs]
+        return torch.stack(self[idxs])
+
+    def __setitem__(self, i, o):
+        super().__setitem__(i, o)
+        self.items_tensor = None
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.items_tensor = None
+
     def __repr__(self):
         return f'Path: {self.path}\n{super().__repr__()}'
 
@@ -307,6 +324,8 @@ class LabeledData():
 
     def __getitem__(self, i): return self.x[i], self.y[i]
 
+    def get_batch(self, idxs): return self.x.get_batch(idxs), self.y.get_batch(idxs)
+
     def __len__(self): return len(self.x)
 
     def __repr__(self):
@@ -7,6 +7,12 @@ import sys
 sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
 
 import math
+import time
+import queue
+import threading
+import traceback
+import itertools
+import torch.multiprocessing as mp
 from data_block import *
 
 class Dataset():
@@ -25,6 +31,8 @@ class Dataset():
 
     def __getitem__(self, i): return self.x_data[i], self.y_data[i]
 
+    def get_batch(self, idxs): return self.x_data[idxs], self.y_data[idxs]
+
 class Sampler():
     def __init__(self, size, batch_size, shuffle):
         '''Simple indices generator with option to randomly sample input data.
@@ -53,20 +61,150 @@ def collate(batch):
     x_batch, y_batch = zip(*batch)
     return torch.stack(x_batch), torch.stack(y_batch)
 
+def _worker_loop(load_batch, jobs, results, seed):
+    '''Worker process of DataLoader, loads the batches of the jobs it receives until it gets None.
+        load_batch: fn turning sampled indices into a collated batch
+        jobs: queue of (batch number, indices) for this worker
+        results: queue of (batch number, batch) shared by all workers
+        seed: seed for the random number generators of the worker (random augmentations)
+    '''
+    random.seed(seed)
+    torch.manual_seed(seed)
+    # results left in the queue when the main process stops early can be dropped
+    results.cancel_join_thread()
+    for i, idxs in iter(jobs.get, None):
+        try:
+            # tensors put in a torch multiprocessing queue are moved to shared memory, only handles are pickled
+            results.put((i, load_batch(idxs)))
+        except Exception:
+            results.put((i, RuntimeError(traceback.format_exc())))
+
 class DataLoader():
-    def __init__(self, dataset, sampler, collate_fn=collate):
+    def __init__(self, dataset, sampler, collate_fn=collate, prefetch=0, num_workers=0):
         '''Data loader class with data/label data and sampler to batch generation.
             dataset: Dataset class with x and y data
             sampler: Sampler class
             collate_fn: collate function for sampled batches
+            prefetch: number of batches assembled ahead by a background thread (0 to assemble synchronously)
+            num_workers: number of worker processes assembling batches (0 to assemble in the main process)
         '''
         self.dataset = dataset
         self.sampler = sampler
         self.collate_fn = collate_fn
+        self.prefetch = prefetch
+        self.num_workers = num_workers
+        self.reset_stats()
+
+    def reset_stats(self):
+        # starved: batches the consumer had to wait for, wait_time: total seconds spent waiting
+        self.batches, self.starved, self.wait_time = 0, 0, 0.
+
+    def load_batch(self, idxs):
+        # datasets with get_batch gather the whole (already collated) batch at once instead of item by item
+        if self.collate_fn is collate and hasattr(self.dataset, 'get_batch'):
+            return self.dataset.get_batch(idxs)
+        return self.collate_fn([self.dataset[i] for i in idxs])
 
     def __iter__(self):
+        if self.num_workers > 0:
+            yield from self._workers_iter()
+            return
+        if self.prefetch > 0:
+            yield from self._prefetch_iter()
+            return
         for idxs in self.sampler:
-            yield self.collate_fn([self.dataset[i] for i in idxs])
+            yield self.load_batch(idxs)
+
+    def _produce(self, batches, stop):
+        def put(item):
+            # time out regularly so that the thread exits when consumer stops early
+            while not stop.is_set():
+                try: return batches.put(item, timeout=0.1)
+                except queue.Full: pass
+        try:
+            for idxs in self.sampler:
+                if stop.is_set(): return
+                put(self.load_batch(idxs))
+            put(StopIteration())
+        except Exception as e:
+            put(e)
+
+    def _prefetch_iter(self):
+        batches, stop = queue.Queue(maxsize=self.prefetch), threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = self._timed_get(batches)
+                if isinstance(batch, StopIteration): return
+                if isinstance(batch, Exception): raise batch
+                self.batches += 1
+                yield batch
+        finally:
+            # reached on exhaustion and when consumer stops early (ex. CancelEpochException closing the iterator)
+            stop.set()
+            producer.join()
+
+    def _workers_iter(self):
+        # sampler is iterated in the main process and batches are yielded in its order
+        samples = iter(self.sampler)
+        first = next(samples, None)
+        if first is None: return
+        samples = itertools.chain([first], samples)
+
+        # seeds drawn from the main process generator (after sampler shuffled), so worker augmentations are reproducible
+        base_seed = int(torch.randint(2**31, (1,)))
+        jobs = [mp.Queue() for _ in range(self.num_workers)]
+        results = mp.Queue()
+        # workers are forked before any queue feeder thread exists
+        workers = [mp.Process(target=_worker_loop, args=(self.load_batch, jobs[w], results, base_seed + w), daemon=True)
+                   for w in range(self.num_workers)]
+        for worker in workers: worker.start()
+
+        sent, done, arrived = 0, 0, {}
+        def send():
+            nonlocal sent
+            idxs = next(samples, None)
+            if idxs is None: return
+            jobs[sent % self.num_workers].put((sent, idxs))
+            sent += 1
+
+        try:
+            for _ in range(max(self.prefetch, 2 * self.num_workers)): send()
+            while done < sent:
+                while done not in arrived:
+                    i, batch = self._timed_get(results, workers)
+                    arrived[i] = batch
+                batch = arrived.pop(done)
+                done += 1
+                if isinstance(batch, Exception): raise batch
+                send()
+                self.batches += 1
+                yield batch
+        finally:
+            for job in jobs: job.put(None)
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive(): worker.terminate()
+
+    def _timed_get(self, batches, workers=[]):
+        try:
+            return batches.get_nowait()
+        except queue.Empty:
+            start = time.perf_counter()
+            batch = self._wait(batches, workers)
+            self.starved += 1
+            self.wait_time += time.perf_counter() - start
+            return batch
+
+    def _wait(self, batches, workers):
+        if not workers: return batches.get()
+        # a worker killed without reporting an error (ex. SIGKILL, out of memory killer) would never post its batch
+        while True:
+            try: return batches.get(timeout=0.1)
+            except queue.Empty:
+                dead = [worker for worker in workers if not worker.is_alive()]
+                if dead: raise RuntimeError(f'DataLoader worker (pid {dead[0].pid}) exited unexpectedly with exit code {dead[0].exitcode}')
 
     def __repr__(self, t=''):
         tt = t + '    '
@@ -96,16 +234,17 @@ class DataBunch():
 
     def __len__(self): return len(self.train_dl)
 
-def get_data_bunch(xt, yt, xv, yv, batch_size):
+def get_data_bunch(xt, yt, xv, yv, batch_size, prefetch=0):
     '''Util function for converting existing data to data bunch class for training.
         xt: x (input) training data
         yt: y (label) training data
         xv: x (input) validation data
         yv: y (label) validation data
         batch_size: number of items per iteration
+        prefetch: number of batches assembled ahead in background (0 to disable)
     '''
     train_ds = Dataset(xt, yt)
     valid_ds = Dataset(xv, yv)
-    train_dl = DataLoader(train_ds, Sampler(len(train_ds), batch_size, True))
-    valid_dl = DataLoader(valid_ds, Sampler(len(valid_ds), batch_size*2, False)) # twice batch size (no backprop)
+    train_dl = DataLoader(train_ds, Sampler(len(train_ds), batch_size, True), prefetch=prefetch)
+    valid_dl = DataLoader(valid_ds, Sampler(len(valid_ds), batch_size*2, False), prefetch=prefetch) # twice batch size (no backprop)
     return DataBunch(train_dl, valid_dl)
\ No newline at end of file
@@ -0,0 +1,311 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/34_data_parallel.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from bn_folding import *
+import copy
+import io
+import pickle
+import queue
+import traceback
+import torch.multiprocessing as mp
+
+class ShardSampler(Sampler):
+    def __init__(self, sampler, rank, world_size, seed=0):
+        '''Sampler yielding one shard of every batch of sampler, the shards of all ranks make up the batch.
+            sampler: Sampler to shard (size, batch size and shuffling)
+            rank: index of the shard
+            world_size: number of shards
+            seed: seed of the shuffling, the same on every rank so that all ranks shard the same batches
+        '''
+        super().__init__(sampler.size, sampler.batch_size, sampler.shuffle)
+        self.rank, self.world_size = rank, world_size
+        # own generator: the global one is also drawn from by the layers and augmentations of each rank
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def __iter__(self):
+        self.idxs = torch.randperm(self.size, generator=self.generator) if self.shuffle else torch.arange(self.size)
+        for i in range(0, self.size, self.batch_size):
+            idxs = self.idxs[i: i+self.batch_size]
+            # batches too small to give every rank a sample are dropped
+            if len(idxs) >= self.world_size: yield idxs[self.rank::self.world_size]
+
+    def __repr__(self, t=''):
+        return f'{t}(ShardSampler) total: {self.size}, batch_size: {self.batch_size}, shuffle: {self.shuffle}, shard: {self.rank}/{self.world_size}'
+
+def get_alive(results, processes, interval=0.1):
+    '''Get the next item of results, raises RuntimeError when one of processes died without posting (ex. SIGKILL, out of memory killer).
+        results: multiprocessing queue the processes post to
+        processes: processes posting to results (errors are posted, a clean exit has exit code 0)
+        interval: seconds between liveness checks
+    '''
+    while True:
+        try: return results.get(timeout=interval)
+        except queue.Empty:
+            dead = [p for p in processes if p.exitcode not in [None, 0]]
+            if dead: raise RuntimeError(f'worker process (pid {dead[0].pid}) exited unexpectedly with exit code {dead[0].exitcode}')
+
+class AllReduce():
+    def __init__(self, world_size, numel, timeout=300):
+        '''Sum of tensors over worker processes through shared memory, each worker reduces 1/world_size of the elements (reduce-scatter then all-gather).
+            world_size: number of worker processes
+            numel: maximum number of elements reduced at once
+            timeout: seconds a worker waits for the others before the barrier breaks (a worker may have died)
+        '''
+        self.world_size = world_size
+        self.rank = 0
+        # created before the workers are forked, so that all of them map the same memory
+        self.rows = torch.zeros(world_size, numel).share_memory_()
+        self.result = torch.zeros(numel).share_memory_()
+        self.barrier = mp.Barrier(world_size, timeout=timeout)
+
+    def __call__(self, *tensors):
+        '''Replace tensors (in-place) with their sum over workers, every worker gets the same bits.'''
+        n = self.scatter(tensors)
+        start, end = n * self.rank // self.world_size, n * (self.rank+1) // self.world_size
+        torch.sum(self.rows[:, start:end], 0, out=self.result[start:end])
+        self.barrier.wait()
+        self.gather(tensors, self.result)
+        return tensors
+
+    def identical(self, *tensors):
+        '''Whether every worker holds the very same values in tensors.'''
+        self.scatter(tensors)
+        same = all(torch.equal(self.rows[0], row) for row in self.rows[1:])
+        self.barrier.wait()
+        return same
+
+    def scatter(self, tensors):
+        # rows are only written once every worker is done reading them (second barrier of the previous call)
+        n = 0
+        for t in tensors:
+            self.rows[self.rank, n: n+t.numel()].copy_(t.reshape(-1))
+            n += t.numel()
+        self.barrier.wait()
+        return n
+
+    def gather(self, tensors, flat):
+        n = 0
+        for t in tensors:
+            t.copy_(flat[n: n+t.numel()].view_as(t))
+            n += t.numel()
+
+    def abort(self): self.barrier.abort()
+
+def batch_norms(model):
+    '''Every batch norm layer of a model tree (in the order of the layers).
+        model: Sequential model or layer
+    '''
+    if isinstance(model, BatchNorm): yield model
+    children = model.layers if isinstance(model, Sequential) else vars(model).values()
+    for child in children:
+        if isinstance(child, (Sequential, Module)): yield from batch_norms(child)
+
+def running_stats(model):
+    '''Running mean and variance tensors of every batch norm layer of a model tree.
+        model: Sequential model or layer
+    '''
+    return [t for bn in batch_norms(model) for t in [bn.mean, bn.var]]
+
+class DataParallel(Callback):
+    order = -1 # aggregates stats before the other callbacks report them
+
+    def __init__(self, all_reduce, arena):
+        '''Callback of a data parallel worker, averages gradients before every optimizer step and aggregates statistics over the workers.
+            all_reduce: AllReduce shared by the workers
+            arena: ParameterArena of the worker's model replica
+        '''
+        self.all_reduce, self.arena = all_reduce, arena
+
+    def after_model_back(self):
+        # gradients are averages over the shards, the batch gradient weighs them by shard size
+        n = torch.tensor([float(self.x_batch.shape[0])])
+        self.all_reduce(self.arena.grad.mul_(n), n)
+        self.arena.grad.div_(n)
+
+    def before_valid(self): self.average_running_stats()
+
+    def average_running_stats(self):
+        # running statistics of the replicas saw different shards
+        stats = running_stats(self.model)
+        if stats:
+            for t in self.all_reduce(*stats): t.div_(self.all_reduce.world_size)
+
+    def after_epoch(self):
+        # AvgStats of every callback (ex. StatsLogging, AccuracyStopper) become stats over the whole dataset
+        for callback in self.callbacks:
+            for stats in vars(callback).values():
+                if isinstance(stats, AvgStats) and hasattr(stats, 'count'): self.reduce_stats(stats)
+
+    def reduce_stats(self, stats):
+        totals = torch.cat([torch.tensor([float(stats.count)])] + [s.reshape(-1).float() for s in stats.all_stats])
+        self.all_reduce(totals)
+        stats.count, stats.total_loss, stats.totals = int(totals[0]), totals[1:2], list(totals[2:].split(1))
+
+class _StatePickler(pickle.Pickler):
+    def __init__(self, file, shared):
+        super().__init__(file)
+        self.ids = {id(obj): i for i, obj in enumerate(shared)}
+
+    def persistent_id(self, obj): return self.ids.get(id(obj))
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, shared):
+        super().__init__(file)
+        self.shared = shared
+
+    def persistent_load(self, i): return self.shared[i]
+
+def dump_state(obj, shared):
+    '''Pickle the attributes of obj, shared objects (ex. learner, parameters) are pickled as their index in shared.
+        obj: object to pickle the state of (ex. optimizer, callback)
+        shared: objects that exist in both processes, in the same order
+    '''
+    file = io.BytesIO()
+    _StatePickler(file, shared).dump(vars(obj))
+    return file.getvalue()
+
+def load_state(obj, state, shared):
+    '''Update the attributes of obj with a state pickled by dump_state, indices are replaced by the objects in shared.
+        obj: object to update
+        state: bytes returned by dump_state
+        shared: objects that exist in both processes, in the same order
+    '''
+    vars(obj).update(_StateUnpickler(io.BytesIO(state), shared).load())
+
+def _fit_worker(learner, rank, num_epochs, results):
+    '''Worker process of DataParallelLearner, trains its replica on shard rank of every batch.
+        learner: DataParallelLearner (forked copy)
+        rank: index of the worker
+        num_epochs: number of epochs
+        results: queue of (rank, error or None, optimizer and callback states or None) shared by all workers
+    '''
+    try:
+        results.put((rank, None, learner.fit_replica(rank, num_epochs)))
+    except BaseException:
+        # workers waiting on the others get a BrokenBarrierError instead of hanging
+        learner.all_reduce.abort()
+        results.put((rank, RuntimeError(traceback.format_exc()), None))
+
+class DataParallelLearner(Learner):
+    def __init__(self, data_bunch, model, loss_fn, optimizer, callbacks=[], num_workers=2, micro_batches=1):
+        '''Learner training replicas of the model in num_workers processes, each on a disjoint shard of every batch (the trained parameters are loaded back into model).
+            data_bunch: data bunch with training and validation data
+            model: Sequential model
+            loss_fn: fn that takes in predicted labels and labels to compute loss
+            optimizer: optimizer that keeps track of hyperparameters and updates parameters
+            callbacks: callback function for flexible training procedure (must take the same decisions on every worker, only the first worker prints)
+            num_workers: number of worker processes
+            micro_batches: number of micro-batches each shard is split into
+        '''
+        super().__init__(data_bunch, model, loss_fn, optimizer, callbacks, micro_batches)
+        self.num_workers = num_workers
+
+    def fit(self, num_epochs):
+        params = list(self.model.parameters())
+        num_params = sum(p.data.numel() for p in params)
+        num_stats = sum(t.numel() for t in running_stats(self.model))
+        # large enough for the replica check of parameters and running statistics
+        self.all_reduce = AllReduce(self.num_workers, num_params + num_stats + 64)
+        # trained parameters and running statistics of the first worker
+        self.state = torch.zeros(num_params + num_stats).share_memory_()
+        self.seed = int(torch.randint(2**31, (1,)))
+
+        results = mp.Queue()
+        workers = [mp.Process(target=_fit_worker, args=(self, rank, num_epochs, results)) for rank in range(self.num_workers)]
+        for worker in workers: worker.start()
+        try:
+            outcomes = sorted(get_alive(results, workers) for _ in workers)
+        except RuntimeError:
+            # replicas waiting for the dead one at the barrier fail right away
+            self.all_reduce.abort()
+            raise
+        finally:
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive(): worker.terminate()
+        # the other workers fail on the aborted barrier, report the error that caused it
+        errors = sorted([error for _, error, _ in outcomes if error is not None], key=lambda error: 'BrokenBarrierError' in str(error))
+        if errors: raise errors[0]
+
+        self.all_reduce.gather([p.data for p in params] + running_stats(self.model), self.state)
+        # optimizer (ex. adam moments) and callbacks (ex. stats) continue from the first worker on the next fit
+        optimizer_state, callback_states = outcomes[0][2]
+        load_state(self.optimizer, optimizer_state, self.shared_objects())
+        for callback, state in zip(self.callbacks, callback_states):
+            if state is not None: load_state(callback, state, self.shared_objects())
+
+    def shared_objects(self):
+        # objects the optimizer and callback states may refer to, the same in the main and worker processes
+        return [self, self.model, self.optimizer] + self.callbacks + list(self.model.parameters())
+
+    def dump_states(self):
+        '''Pickled states of the optimizer and callbacks (callbacks that can't be pickled, ex. progress bars, are skipped).'''
+        callback_states = []
+        for callback in self.callbacks:
+            try: callback_states.append(dump_state(callback, self.shared_objects()))
+            except (pickle.PicklingError, TypeError, AttributeError): callback_states.append(None)
+        return dump_state(self.optimizer, self.shared_objects()), callback_states
+
+    def fit_replica(self, rank, num_epochs):
+        '''Training loop of worker rank (runs in the worker process), the first worker returns the states of the optimizer and callbacks.'''
+        self.rank = self.all_reduce.rank = rank
+        # cores are split between the workers
+        torch.set_num_threads(max(1, torch.get_num_threads() // self.num_workers))
+        if rank != 0: sys.stdout = open(os.devnull, 'w')
+        for data_loader in [self.data_bunch.train_dl, self.data_bunch.valid_dl]:
+            data_loader.sampler = ShardSampler(data_loader.sampler, rank, self.num_workers, self.seed)
+        # gradients of the replica in one contiguous buffer, reduced with a single all-reduce
+        arena = ParameterArena(self.model.parameters())
+        callbacks, callback = self.callbacks, DataParallel(self.all_reduce, arena)
+        self.add_callbacks(callback)
+
+        Learner.fit(self, num_epochs)
+        # same callbacks in the same order as in the main process
+        self.callbacks = callbacks
+
+        # training may have been cancelled before the running statistics were averaged
+        callback.average_running_stats()
+        stats = running_stats(self.model)
+        assert self.all_reduce.identical(arena.data, *stats), 'replicas diverged'
+        if rank == 0:
+            self.state.copy_(torch.cat([arena.data] + [t.reshape(-1) for t in stats]))
+            return self.dump_states()
+
+    def __repr__(self):
+        return f'{super().__repr__()}\n(DataParallel) workers: {self.num_workers}'
+
+def get_synthetic_data(num_train, num_valid, in_dim=784, num_classes=10):
+    '''Learnable synthetic data (labels of a random linear map, seeded), returns x_train, y_train, x_valid, y_valid.
+        num_train: number of training items
+        num_valid: number of validation items
+        in_dim: number of input features
+        num_classes: number of classes
+    '''
+    torch.manual_seed(0)
+    w = torch.randn(in_dim, num_classes)
+    x_train, x_valid = torch.randn(num_train, in_dim), torch.randn(num_valid, in_dim)
+    return x_train, (x_train @ w).argmax(1), x_valid, (x_valid @ w).argmax(1)
+
+def get_test_learner(data, get_model, optimizer_fn, callbacks=None, learner_cls=Learner, shuffle=True, batch_size=64, **kwargs):
+    '''Learner with a seeded model, to compare parallel training with a single process (used by the tests of the parallel notebooks).
+        data: x_train, y_train, x_valid, y_valid
+        get_model: fn that takes in the data bunch and returns the model
+        optimizer_fn: fn that takes in the model and returns its optimizer
+        callbacks: callbacks of the learner (None for a StatsLogging)
+        learner_cls: learner class (ex. DataParallelLearner)
+        shuffle: whether the training data is shuffled
+        batch_size: number of training items per iteration
+        kwargs: other arguments of learner_cls (ex. num_workers)
+    '''
+    torch.manual_seed(0)
+    x_train, y_train, x_valid, y_valid = data
+    data_bunch = DataBunch(DataLoader(Dataset(x_train, y_train), Sampler(len(x_train), batch_size, shuffle)),
+                           DataLoader(Dataset(x_valid, y_valid), Sampler(len(x_valid), batch_size*2, False)))
+    model = get_model(data_bunch)
+    callbacks = [StatsLogging()] if callbacks is None else callbacks
+    return learner_cls(data_bunch, model, CrossEntropy(), optimizer_fn(model), callbacks, **kwargs)
\ No newline at end of file
@@ -0,0 +1,155 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/39_grad_compression.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from param_server import *
+
+def part_bytes(dtype, count):
+    '''Bytes of count values of dtype in a payload, padded to 4 bytes so that every part is aligned.'''
+    return -(-count * torch.empty(0, dtype=dtype).element_size() // 4) * 4
+
+class Compressor():
+    def __init__(self, error_feedback=False):
+        '''Base gradient compressor, a gradient is compressed into a list of tensors (parts) and decompressed back.
+            error_feedback: whether the compression error of a gradient is added to the next gradient of the same parameter
+        '''
+        self.error_feedback = error_feedback
+        # residuals of the last compressed gradients, kept by commit once the receiver applied them
+        self.residuals, self.pending = {}, {}
+        self.ratios, self.latencies = [], []
+
+    def compress(self, grad):
+        '''Compress a gradient into a list of tensors (parts), their dtypes and sizes are given by specs.
+            grad: gradient tensor
+        '''
+        raise NotImplementedError('Compressor.compress')
+
+    def decompress(self, parts, shape):
+        '''Gradient of shape rebuilt from the parts returned by compress.
+            parts: list of tensors
+            shape: shape of the gradient
+        '''
+        raise NotImplementedError('Compressor.decompress')
+
+    def specs(self, numel):
+        '''(dtype, count) of each part of a compressed gradient of numel values.
+            numel: number of values of the gradient
+        '''
+        raise NotImplementedError('Compressor.specs')
+
+    def __call__(self, param, grad):
+        '''Compress grad of param, returns the parts (with error feedback, call commit once they are applied or discard if they are dropped).'''
+        if not self.error_feedback: return self.compress(grad)
+        # accumulated gradient, then what compression dropped from it
+        acc = grad + self.residuals[param] if param in self.residuals else grad.clone()
+        parts = self.compress(acc)
+        self.pending[param] = acc.sub_(self.decompress(parts, acc.shape))
+        return parts
+
+    def commit(self):
+        '''Keep the residuals of the gradients compressed since the last commit (the receiver applied them).'''
+        self.residuals.update(self.pending)
+        self.pending = {}
+
+    def discard(self):
+        '''Drop the residuals of the gradients compressed since the last commit (ex. a stale push the server rejected).'''
+        self.pending = {}
+
+    def payload_size(self, params):
+        '''Bytes of the compressed gradients of params.'''
+        return sum(part_bytes(dtype, count) for p in params for dtype, count in self.specs(p.data.numel()))
+
+    def record(self, params, start):
+        self.ratios.append(sum(p.data.numel() * 4 for p in params) / self.payload_size(params))
+        self.latencies.append(time.perf_counter() - start)
+
+    def compress_grads(self, params):
+        '''Replace the gradients of params with their compressed and decompressed version (what a receiver would get).'''
+        params, start = [p for p in params if torch.is_tensor(p.grad)], time.perf_counter()
+        for param in params:
+            grad = self.decompress(self(param, param.grad), param.data.shape)
+            if param.packed or param.accumulate: param.grad.copy_(grad)
+            else: param.grad = grad
+        self.commit()
+        self.record(params, start)
+
+    def encode(self, params, buf):
+        '''Compress the gradients of params into buf, returns the number of bytes written (call commit or discard once the receiver answered).'''
+        params, start, offset = list(params), time.perf_counter(), 0
+        for param in params:
+            for part, (dtype, count) in zip(self(param, param.grad), self.specs(param.data.numel())):
+                torch.frombuffer(buf, dtype=dtype, count=count, offset=offset).copy_(part.reshape(-1))
+                offset += part_bytes(dtype, count)
+        self.record(params, start)
+        return offset
+
+    def decode(self, params, buf):
+        '''Decompress the gradients of params from buf (written by encode).'''
+        offset = 0
+        for param in params:
+            parts = []
+            for dtype, count in self.specs(param.data.numel()):
+                parts.append(torch.frombuffer(buf, dtype=dtype, count=count, offset=offset))
+                offset += part_bytes(dtype, count)
+            param.update(self.decompress(parts, param.data.shape))
+
+    def __repr__(self):
+        if not self.ratios: return f'({self.__class__.__name__})'
+        return f'({self.__class__.__name__}) compression ratio: {sum(self.ratios)/len(self.ratios):.1f}x, added latency: {1000*sum(self.latencies)/len(self.latencies):.3f}ms per step'
+
+class TopK(Compressor):
+    def __init__(self, ratio=0.01, error_feedback=True):
+        '''Top-k sparsification, keeps the ratio largest magnitude values of each gradient and their indices.
+            ratio: fraction of the values kept
+            error_feedback: whether the dropped values are added to the next gradient of the same parameter
+        '''
+        super().__init__(error_feedback)
+        self.ratio = ratio
+
+    def k(self, numel): return max(1, int(numel * self.ratio))
+
+    def compress(self, grad):
+        flat = grad.reshape(-1)
+        idxs = flat.abs().topk(self.k(flat.numel()), sorted=False)[1]
+        return [idxs.int(), flat[idxs]]
+
+    def decompress(self, parts, shape):
+        idxs, values = parts
+        return torch.zeros(shape).view(-1).index_copy_(0, idxs.long(), values).view(shape)
+
+    def specs(self, numel): return [(torch.int32, self.k(numel)), (torch.float32, self.k(numel))]
+
+class Quantize8(Compressor):
+    def __init__(self, error_feedback=False):
+        '''Per-tensor 8-bit quantization, each gradient is sent as int8 values and a float32 scale.
+            error_feedback: whether the rounding errors are added to the next gradient of the same parameter
+        '''
+        super().__init__(error_feedback)
+
+    def compress(self, grad):
+        # the largest magnitude maps to 127, a zero gradient keeps a non-zero scale
+        scale = (grad.abs().max() / 127).clamp_(min=torch.finfo(torch.float32).tiny)
+        return [scale.view(1), (grad / scale).round_().to(torch.int8).view(-1)]
+
+    def decompress(self, parts, shape):
+        scale, values = parts
+        return values.float().mul_(scale).view(shape)
+
+    def specs(self, numel): return [(torch.float32, 1), (torch.int8, numel)]
+
+class GradCompression(Callback):
+    order = -2 # compresses the local gradients before DataParallel all-reduces them
+
+    def __init__(self, compressor):
+        '''Callback compressing the gradients between the model backward pass and the optimizer step.
+            compressor: gradient compressor (ex. TopK, Quantize8)
+        '''
+        self.compressor = compressor
+
+    def after_model_back(self): self.compressor.compress_grads(self.model.parameters())
+
+    def after_epoch(self): print(self.compressor)
\ No newline at end of file
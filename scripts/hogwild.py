@@ -0,0 +1,118 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/35_hogwild.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from data_parallel import *
+
+def _hogwild_worker(learner, rank, jobs, results):
+    '''Worker process of HogwildLearner, trains one epoch on its shard of the training data for every epoch it receives until it gets None.
+        learner: HogwildLearner (forked copy, parameters in shared memory)
+        rank: index of the worker
+        jobs: queue of epochs for this worker
+        results: queue of (rank, epoch result or error) shared by all workers
+    '''
+    try:
+        learner.setup_worker(rank)
+        for epoch in iter(jobs.get, None):
+            results.put((rank, learner.train_epoch(epoch)))
+    except BaseException:
+        results.put((rank, RuntimeError(traceback.format_exc())))
+
+class HogwildLearner(Learner):
+    def __init__(self, data_bunch, model, loss_fn, optimizer, callbacks=[], num_workers=2):
+        '''Learner training the shared parameters of the model in num_workers processes without locks, the main process validates and runs the epoch level callbacks.
+            data_bunch: data bunch with training and validation data
+            model: Sequential model (its parameters are moved to shared memory)
+            loss_fn: fn that takes in predicted labels and labels to compute loss
+            optimizer: optimizer that updates parameters in-place (ex. StatelessOpt)
+            callbacks: callback function for flexible training procedure (batch events run in the workers, the other events in the main process)
+            num_workers: number of worker processes
+        '''
+        super().__init__(data_bunch, model, loss_fn, optimizer, callbacks)
+        self.num_workers = num_workers
+        # data of every parameter becomes a view of one shared arena, gradients stay private to each worker
+        self.arena = ParameterArena(self.model.parameters())
+        self.arena.data.share_memory_()
+        # training samples per second of every epoch
+        self.throughputs = []
+
+    def callback_stats(self):
+        # AvgStats of every callback (ex. StatsLogging, AccuracyStopper) in a fixed order
+        return [stats for callback in self.callbacks for stats in vars(callback).values() if isinstance(stats, AvgStats)]
+
+    def fit(self, num_epochs):
+        self.num_epochs = num_epochs
+        for callback in self.callbacks:
+            callback.set_learner(self)
+        self.build_dispatch()
+        self.seed = int(torch.randint(2**31, (1,)))
+
+        if self('before_fit'):       return
+        # workers are forked after before_fit, so that they start with the callbacks' state
+        jobs, results = [mp.Queue() for _ in range(self.num_workers)], mp.Queue()
+        workers = [mp.Process(target=_hogwild_worker, args=(self, rank, jobs[rank], results), daemon=True) for rank in range(self.num_workers)]
+        for worker in workers: worker.start()
+        try:
+            for epoch in range(1, num_epochs+1):
+                self.epoch = epoch
+                if self('before_epoch'): return
+                if self.train_workers(jobs, results, workers): raise CancelTrainException()
+                if self('before_valid'): return
+                self.all_batches()
+                if self('after_epoch'): break
+        except CancelTrainException:
+            self('after_cancel_train')
+        finally:
+            for job in jobs: job.put(None)
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive(): worker.terminate()
+            self('after_fit')
+
+    def train_workers(self, jobs, results, workers):
+        '''Train one epoch in every worker, merge their training stats, returns whether a worker cancelled training (raises RuntimeError if a worker died).'''
+        start = time.time()
+        for job in jobs: job.put(self.epoch)
+        outcomes = [outcome for _, outcome in sorted(get_alive(results, workers) for _ in jobs)]
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        if errors: raise errors[0]
+        self.throughputs.append(sum(samples for samples, _, _ in outcomes) / (time.time() - start))
+        for _, worker_stats, _ in outcomes:
+            for stats, (count, total_loss, totals) in zip(self.callback_stats(), worker_stats):
+                stats.count += count
+                stats.total_loss = stats.total_loss + total_loss
+                stats.totals = [total + t for total, t in zip(stats.totals, totals)]
+        return any(cancelled for _, _, cancelled in outcomes)
+
+    def setup_worker(self, rank):
+        '''Shard the training data of worker rank (runs in the worker process).'''
+        self.rank = rank
+        torch.set_num_threads(max(1, torch.get_num_threads() // self.num_workers))
+        if rank != 0: sys.stdout = open(os.devnull, 'w')
+        # every worker takes full size batches out of a disjoint shard of the (same) permutation
+        train_dl = self.data_bunch.train_dl
+        sampler = Sampler(train_dl.sampler.size, train_dl.sampler.batch_size * self.num_workers, train_dl.sampler.shuffle)
+        train_dl.sampler = ShardSampler(sampler, rank, self.num_workers, self.seed)
+
+    def train_epoch(self, epoch):
+        '''One epoch over the shard of the worker, returns (number of samples, training stats, whether training was cancelled).'''
+        self.epoch = epoch
+        for stats in self.callback_stats(): stats.reset()
+        self.samples, cancelled = 0, False
+        try:
+            self('before_train')
+            self.all_batches()
+        except CancelTrainException:
+            cancelled = True
+        return self.samples, [(stats.count, stats.total_loss, stats.totals) for stats in self.callback_stats()], cancelled
+
+    def one_batch(self, x_batch, y_batch):
+        if self.model.training: self.samples += x_batch.shape[0]
+        super().one_batch(x_batch, y_batch)
+
+    def __repr__(self):
+        return f'{super().__repr__()}\n(Hogwild) workers: {self.num_workers}'
\ No newline at end of file
@@ -31,14 +31,23 @@ class CancelBatchException(Exception):
         '''Exception class for early stopping batch.'''
         pass
 
+def callback_hooks(callback):
+    '''Names of the events (Callback.EVENTS) a callback implements on top of Callback.
+        callback: Callback instance
+    '''
+    # looked up on the classes, getattr of a missing hook would fall through Callback.__getattr__ to the learner
+    mro = type(callback).__mro__
+    return {name for cls in mro[:mro.index(Callback)] for name, fn in vars(cls).items() if name in Callback.EVENTS and callable(fn)}
+
 class Learner():
-    def __init__(self, data_bunch, model, loss_fn, optimizer, callbacks=[]):
+    def __init__(self, data_bunch, model, loss_fn, optimizer, callbacks=[], micro_batches=1):
         '''Learner class containing data bunch, model, loss function, optimizer, and callbacks for flexible training procedures.
             data_bunch: data bunch with training and validation data
             model: Sequential model
             loss_fn: fn that takes in predicted labels and labels to compute loss
             optimizer: optimizer that keeps track of hyperparameters and updates parameters
             callbacks: callback function for flexible training procedure
+            micro_batches: number of micro-batches each training batch is split into (gradients accumulate, one optimizer step per batch)
         '''
         self.data_bunch = data_bunch
         self.model = model
@@ -47,48 +56,115 @@ class Learner():
         self.callbacks = sorted([TrainEval()] + callbacks, key=lambda cb: cb.order)
         for callback in self.callbacks:
             callback.learner = self
+        self.build_dispatch()
+        self.micro_batches = micro_batches
 
     def __repr__(self):
         return f'{self.data_bunch}\n{self.model}\n{self.loss_fn}\n{self.optimizer}\n(Callbacks) {[cb.__class__.__name__ for cb in self.callbacks]}'
 
+    def build_dispatch(self):
+        '''Table of the hooks of each event (in callback order), only the callbacks implementing an event are called for it.
+            It is rebuilt at the start of fit and by add_callbacks/remove_callbacks, rebuild it after changing self.callbacks in any other way.
+        '''
+        self.dispatch = {}
+        for callback in self.callbacks:
+            for name in callback_hooks(callback):
+                self.dispatch.setdefault(name, []).append(getattr(callback, name))
+
+    def add_callbacks(self, *callbacks):
+        for callback in callbacks:
+            callback.set_learner(self)
+        self.callbacks = sorted(self.callbacks + list(callbacks), key=lambda cb: cb.order)
+        self.build_dispatch()
+
+    def remove_callbacks(self, *callbacks):
+        self.callbacks = [cb for cb in self.callbacks if cb not in callbacks]
+        self.build_dispatch()
+
     def one_batch(self, x_batch, y_batch):
         try:
             self.x_batch = x_batch
             self.y_batch = y_batch
             if self('before_batch'):     return
-            self.pred = self.model(self.x_batch)
-            if self('after_pred'):       return
-            self.loss = self.loss_fn(self.pred, self.y_batch)
-            if self('after_loss'):       return
-            if not self.model.training:  return
-            self.loss_fn.backward()
-            if self('after_loss_back'):  return
-            self.model.backward()
-            if self('after_model_back'): return
+            if self.model.training and self.micro_batches > 1:
+                if self.accumulate_grads():  return
+                if self('after_model_back'): return
+            else:
+                self.pred = self.model(self.x_batch)
+                if self('after_pred'):       return
+                self.loss = self.loss_fn(self.pred, self.y_batch)
+                if self('after_loss'):       return
+                if not self.model.training:  return
+                self.loss_fn.backward()
+                if self('after_loss_back'):  return
+                self.model.backward()
+                if self('after_model_back'): return
             self.optimizer.step()
             if self('after_step'):       return
             self.optimizer.zero_grad()
         except CancelBatchException:
             self('after_cancel_batch')
 
+    def accumulate_grads(self):
+        '''Forward and backward pass of each micro-batch, parameter gradients add up to the gradient of the whole batch, returns whether a callback cancelled the batch.
+            after_pred, after_loss and after_loss_back run for every micro-batch (x_batch, y_batch, pred and loss are the micro-batch's),
+            after_model_back runs once the gradients of the whole batch are complete (ex. gradient clipping, all-reduce).
+        '''
+        x_batch, y_batch = self.x_batch, self.y_batch
+        preds, loss = [], 0.
+        try:
+            for self.x_batch, self.y_batch in zip(x_batch.chunk(self.micro_batches), y_batch.chunk(self.micro_batches)):
+                self.pred = self.model(self.x_batch)
+                if self('after_pred'):      return True
+                pred = self.pred
+                # the loss may overwrite the predictions (ex. FusedCrossEntropy(inplace=True)), metrics need them
+                preds.append(pred.clone())
+                self.loss = self.loss_fn(pred, self.y_batch)
+                self.pred = preds[-1]
+                if self('after_loss'):      return True
+                self.loss_fn.backward()
+                # loss is averaged over the micro-batch, scale its gradient to a share of the batch average
+                ratio = self.y_batch.shape[0] / y_batch.shape[0]
+                pred.g *= ratio
+                loss += self.loss * ratio
+                if self('after_loss_back'): return True
+                self.model.backward()
+        finally:
+            self.x_batch, self.y_batch = x_batch, y_batch
+        self.pred, self.loss = torch.cat(preds), loss
+        return False
+
     def all_batches(self):
         data_loader = self.data_bunch.train_dl if self.model.training else self.data_bunch.valid_dl
         self.iters_count, self.iters = 0, len(data_loader)
+        batches = iter(data_loader)
         try:
-            for x_batch, y_batch in data_loader:
-                self.one_batch(x_batch, y_batch)
-                self.iters_count += 1
-                self('after_batch')
+            # validation (loss included) runs in inference mode, no activations are kept
+            with no_grad(not self.model.training):
+                for x_batch, y_batch in batches:
+                    self.one_batch(x_batch, y_batch)
+                    self.iters_count += 1
+                    self('after_batch')
         except CancelEpochException:
             self('after_cancel_epoch')
+        finally:
+            # stop prefetching data loaders right away (also on CancelTrainException), plain iterators have no close
+            close = getattr(batches, 'close', None)
+            if close: close()
 
     def fit(self, num_epochs):
         self.num_epochs = num_epochs
 
         for callback in self.callbacks:
             callback.set_learner(self)
+        self.build_dispatch()
 
         if self('before_fit'):       return
+        # gradients accumulate over micro-batches during this fit only (the model may be trained by other learners)
+        params = list(self.model.parameters())
+        accumulate = [param.accumulate for param in params]
+        if self.micro_batches > 1:
+            for param in params: param.accumulate = True
         try:
             for epoch in range(1, num_epochs+1):
                 self.epoch = epoch
@@ -102,9 +178,10 @@ class Learner():
             self('after_cancel_train')
         finally:
             self('after_fit')
+            for param, acc in zip(params, accumulate): param.accumulate = acc
 
     def __call__(self, callback_name):
-        for callback in self.callbacks:
-            if callback(callback_name):
+        for hook in self.dispatch.get(callback_name, []):
+            if hook():
                 return True
         return False
\ No newline at end of file
@@ -9,9 +9,13 @@ sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
 from model import *
 
 class Module():
+    requests = None # buffer requests of every layer are recorded here while planning
+
     def __init__(self):
         '''Similar to pytorch Module, parent class to layers.'''
         self._parameters = {}
+        # planned output/gradient buffers of the layer (see MemoryPlan)
+        self.buffers = {}
 
     def __setattr__(self, k, v):
         if isinstance(v, Parameter):
@@ -19,6 +23,10 @@ class Module():
         super().__setattr__(k, v)
 
     def __call__(self, *args):
+        if not grad_enabled():
+            # inference: keep nothing for backward (also frees activations of the last training batch)
+            self.args = self.out = None
+            return self.fwd(*args)
         self.args = args
         self.out = self.fwd(*args)
         return self.out
@@ -31,6 +39,20 @@ class Module():
 
     def backward(self): self.bwd(self.out, *self.args)
 
+    def free(self):
+        '''Drop activations kept for backward (layers with extra caches extend this).'''
+        self.args = self.out = None
+
+    def buffer(self, kind, shape):
+        '''Planned tensor to write the output (or input gradient) into, None to allocate as usual.
+            kind: 'out' for the output of fwd, 'grad' for the input gradient of bwd
+            shape: shape of the tensor
+        '''
+        if Module.requests is not None: Module.requests.append((self, kind, tuple(shape)))
+        buf = self.buffers.get((kind, grad_enabled()))
+        # the plan is for a fixed batch shape (ex. last batch of an epoch is smaller)
+        return buf if buf is not None and buf.shape == shape else None
+
 class Linear(Module):
     def __init__(self, in_dim, num_hidden, end=False, require_grad=True):
         '''Linear layer.
@@ -44,10 +66,11 @@ class Linear(Module):
         self.b = Parameter(init_bias(num_hidden), require_grad)
 
     def fwd(self, inp):
-        return inp @ self.w.data + self.b.data
+        out = self.buffer('out', (inp.shape[0], self.w.data.shape[1]))
+        return torch.addmm(self.b.data, inp, self.w.data, out=out)
 
     def bwd(self, out, inp):
-        inp.g = out.g @ self.w.data.t()
+        inp.g = torch.mm(out.g, self.w.data.t(), out=self.buffer('grad', inp.shape))
         self.w.update(inp.t() @ out.g)
         self.b.update(out.g.sum(0))
 
@@ -60,10 +83,10 @@ class ReLU(Module):
         super().__init__()
 
     def fwd(self, inp):
-        return inp.clamp_min(0.) - 0.5
+        return torch.clamp_min(inp, 0., out=self.buffer('out', inp.shape)).sub_(0.5)
 
     def bwd(self, out, inp):
-        inp.g = (inp > 0).float() * out.g
+        inp.g = torch.mul(out.g, inp > 0, out=self.buffer('grad', inp.shape))
 
     def __repr__(self, t=''):
         return f"{t+'    '}ReLU()"
@@ -84,6 +107,40 @@ class CrossEntropy(Module):
     def __repr__(self):
         return '(CrossEntropy)'
 
+class FusedCrossEntropy(Module):
+    def __init__(self, inplace=False):
+        '''Cross Entropy loss function (as a module) with one exponentiation pass, probabilities cached in fwd become the gradient in bwd.
+            inplace: whether to reuse the logits tensor for probabilities and gradient (logits are overwritten)
+        '''
+        super().__init__()
+        self.inplace = inplace
+
+    def fwd(self, inp, tar):
+        rows = torch.arange(tar.shape[0])
+        inplace = self.inplace and grad_enabled()
+        # log softmax as x - max - log(sum(exp(x - max))), stable for large logits
+        shifted = inp.sub_(inp.max(-1, keepdim=True)[0]) if inplace else inp - inp.max(-1, keepdim=True)[0]
+        target = shifted[rows, tar]
+        probs = shifted.exp_()
+        sums = probs.sum(-1, keepdim=True)
+        loss = (sums.log().squeeze(-1) - target).mean()
+        self.probs = probs.div_(sums) if grad_enabled() else None
+        return loss
+
+    def bwd(self, loss, inp, tar):
+        # (softmax - one hot) / batch size, computed over the cached probabilities
+        grad = self.probs
+        grad[torch.arange(tar.shape[0]), tar] -= 1
+        inp.g = grad.div_(tar.shape[0])
+        self.probs = None
+
+    def free(self):
+        super().free()
+        self.probs = None
+
+    def __repr__(self):
+        return '(FusedCrossEntropy)'
+
 def get_lin_model(data_bunch, num_hidden=50):
     '''Util function for obtaining two (linear) layer fully connected model.
         data_bunch: data bunch with training and validation data
@@ -0,0 +1,115 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/32_memory_plan.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from resnet import *
+
+class MemoryPlan():
+    def __init__(self, model, in_shape, eval_shape=None):
+        '''Static memory plan of a Sequential model, layers write outputs and input gradients into reused preallocated buffers.
+            model: Sequential model (only its top level layers are planned)
+            in_shape: input shape of training batches (batch size included)
+            eval_shape: input shape of evaluation batches (default to in_shape)
+        '''
+        self.model = model
+        self.shapes = {True: tuple(in_shape), False: tuple(eval_shape or in_shape)}
+        # requests of training (grad) and inference steps, never run at the same time so they share buffers
+        self.requests = {grad: self.record(grad) for grad in [True, False]}
+        self.assign()
+        self.apply()
+
+    def record(self, grad):
+        '''Dry run of one training (grad) or inference step, returns the buffer requests (layer index, kind, shape) in order.
+            grad: whether to record a training step (forward and backward) or an inference step
+        '''
+        params = list(self.model.parameters())
+        grads = [param.grad.clone() if torch.is_tensor(param.grad) else param.grad for param in params]
+        training = self.model.training
+        Module.requests = []
+        try:
+            # running statistics and gradients are left as is
+            with frozen_stats():
+                if grad:
+                    self.model.train()
+                    out = self.model(torch.zeros(self.shapes[grad]))
+                    out.g = torch.zeros_like(out)
+                    self.model.backward()
+                else:
+                    self.model.eval_()
+                    self.model(torch.zeros(self.shapes[grad]))
+            requests = Module.requests
+        finally:
+            Module.requests = None
+            self.model.training = training
+            for param, g in zip(params, grads): param.update(g)
+        self.model.free()
+
+        idxs = {id(layer): i for i, layer in enumerate(self.model.layers)}
+        last = len(self.model.layers) - 1
+        # model output is left to the caller (ex. predictions kept across batches)
+        return [(idxs[id(layer)], kind, shape) for layer, kind, shape in requests
+                if id(layer) in idxs and not (idxs[id(layer)] == last and kind == 'out')]
+
+    def lifetimes(self, grad):
+        '''First and last step each buffer is alive on the schedule: fwd of layer i is step i, bwd of layer i is step 2n-1-i.
+            grad: whether to use the training (forward and backward) or the inference schedule
+        '''
+        n = len(self.model.layers)
+        step = lambda i, kind: i if kind == 'out' else 2*n-1-i
+        requests = self.requests[grad]
+        intervals = []
+        for i, kind, _ in requests:
+            start = step(i, kind)
+            if grad and kind == 'out':
+                # activations are used until the bwd of their layer
+                end = 2*n-1-i
+            else:
+                # a buffer is consumed by the next layer writing its own buffer of the same kind (layers in between may return views of it)
+                end = min([step(j, k) for j, k, _ in requests if k == kind and step(j, k) > start], default=2*n)
+            intervals.append((start, end))
+        return intervals
+
+    def assign(self):
+        '''Assign every buffer to a slot (best fit among slots that are free during its lifetime), slots are sized to their largest buffer.'''
+        self.sizes, self.assignment = [], []
+        for grad, requests in self.requests.items():
+            busy, free = [], set(range(len(self.sizes)))
+            for (i, kind, shape), (start, end) in sorted(zip(requests, self.lifetimes(grad)), key=lambda o: o[1][0]):
+                for slot_end, slot in list(busy):
+                    if slot_end < start:
+                        busy.remove((slot_end, slot))
+                        free.add(slot)
+                numel = torch.Size(shape).numel()
+                fits = [slot for slot in free if self.sizes[slot] >= numel]
+                if fits:
+                    slot = min(fits, key=lambda s: self.sizes[s])
+                elif free:
+                    slot = max(free, key=lambda s: self.sizes[s])
+                    self.sizes[slot] = numel
+                else:
+                    slot = len(self.sizes)
+                    self.sizes.append(numel)
+                free.discard(slot)
+                busy.append((end, slot))
+                self.assignment.append((grad, i, kind, shape, slot))
+
+    def apply(self):
+        '''Allocate slots and hand each layer views of them.'''
+        self.slots = [torch.empty(size) for size in self.sizes]
+        for layer in self.model.layers: layer.buffers = {}
+        for grad, i, kind, shape, slot in self.assignment:
+            numel = torch.Size(shape).numel()
+            self.model.layers[i].buffers[(kind, grad)] = self.slots[slot][:numel].view(shape)
+
+    def remove(self):
+        '''Layers allocate as usual again.'''
+        for layer in self.model.layers: layer.buffers = {}
+        self.slots = []
+
+    def __repr__(self):
+        requested = sum(torch.Size(shape).numel() for requests in self.requests.values() for _, _, shape in requests)
+        return f'(MemoryPlan) buffers: {len(self.assignment)}, slots: {len(self.sizes)}, requested: {requested*4/1e6:.1f}MB, planned: {sum(self.sizes)*4/1e6:.1f}MB'
\ No newline at end of file
@@ -8,6 +8,33 @@ sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
 
 from loss import *
 
+class no_grad():
+    enabled = True # grad mode shared by every layer
+    batch_stats = True # whether batch norm normalizes with batch statistics
+
+    def __init__(self, active=True, batch_stats=False):
+        '''Context manager for inference, layers keep no activations for backward and batch norm uses running statistics.
+            active: whether to switch to inference mode (else the current mode is kept)
+            batch_stats: whether batch norm keeps training on batch statistics (forward of checkpointed segments)
+        '''
+        self.active = active
+        self.batch_stats = batch_stats
+
+    def __enter__(self):
+        self.prev = no_grad.enabled, no_grad.batch_stats
+        if self.active: no_grad.enabled, no_grad.batch_stats = False, self.batch_stats
+
+    def __exit__(self, *args):
+        no_grad.enabled, no_grad.batch_stats = self.prev
+
+def grad_enabled():
+    '''Whether layers keep activations for backward (False inside no_grad and in evaluated models).'''
+    return no_grad.enabled
+
+def use_batch_stats():
+    '''Whether batch norm normalizes with batch statistics (else with its running statistics).'''
+    return no_grad.batch_stats
+
 class Sequential():
     def __init__(self, *args):
         '''Sequential Model with stored layers and training status.
@@ -18,8 +45,10 @@ class Sequential():
         self.training = True
 
     def __call__(self, inp):
-        for layer in self.layers:
-            inp = layer(inp)
+        # evaluated models run in inference mode (no activations kept for backward)
+        with no_grad(not self.training):
+            for layer in self.layers:
+                inp = layer(inp)
         return inp
 
     def train(self): self.training = True
@@ -30,6 +59,10 @@ class Sequential():
         for layer in reversed(self.layers):
             layer.backward()
 
+    def free(self):
+        for layer in self.layers:
+            layer.free()
+
     def parameters(self):
         for layer in self.layers:
             for parameter in layer.parameters():
@@ -0,0 +1,177 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/38_param_server.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from tensor_parallel import *
+import socket
+import struct
+
+# message type, parameter version, payload bytes
+HEADER = struct.Struct('!BIQ')
+PULL, WEIGHTS, PUSH, ACCEPTED, STALE = range(5)
+
+def send_msg(sock, kind, version, payload=b''):
+    '''Send one message (header and payload).
+        sock: connected socket
+        kind: message type
+        version: parameter version
+        payload: bytes-like payload
+    '''
+    sock.sendall(HEADER.pack(kind, version, len(payload)))
+    if len(payload): sock.sendall(payload)
+
+def recv_into(sock, buf):
+    '''Fill buf with bytes from sock, returns False if the connection was closed.
+        sock: connected socket
+        buf: writable bytes-like buffer
+    '''
+    view = memoryview(buf)
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0: return False
+        view = view[n:]
+    return True
+
+def recv_msg(sock, buf):
+    '''Receive one message, its payload is written at the start of buf, returns (message type, version) or None if the connection was closed.
+        sock: connected socket
+        buf: writable buffer for the payload (bytearray of the flat parameters, compressed gradients are smaller)
+    '''
+    header = bytearray(HEADER.size)
+    if not recv_into(sock, header): return None
+    kind, version, size = HEADER.unpack(header)
+    assert size <= len(buf), f'unexpected payload of {size} bytes'
+    if size and not recv_into(sock, memoryview(buf)[:size]): return None
+    return kind, version
+
+def flat_buffer(numel):
+    '''Bytearray for the payload of numel float32 values and a tensor viewing it.'''
+    buf = bytearray(numel * 4)
+    return buf, torch.frombuffer(buf, dtype=torch.float32)
+
+class ParameterServer():
+    def __init__(self, model, optimizer, max_staleness=2, host='127.0.0.1', port=0, compressor=None):
+        '''Parameter server process owning the parameters of model and stepping optimizer with the gradients pushed by workers.
+            model: model with the parameters (packed into a shared arena, the trained weights are readable from the main process)
+            optimizer: optimizer of the model parameters (ex. StatelessOpt, StatefulOpt)
+            max_staleness: maximum number of server steps since the weights a gradient was computed on
+            host: host to listen on
+            port: port to listen on (0 for any free port)
+            compressor: compressor the workers send their gradients with (None for raw float32 gradients)
+        '''
+        self.model, self.optimizer, self.max_staleness, self.compressor = model, optimizer, max_staleness, compressor
+        self.arena = ParameterArena(model.parameters())
+        self.arena.data.share_memory_()
+        # version (number of steps), accepted and stale gradients
+        self.counts = torch.zeros(3, dtype=torch.long).share_memory_()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+        self.address = self.sock.getsockname()
+        self.process = None
+
+    def start(self):
+        '''Fork the server process.'''
+        self.process = mp.Process(target=self.serve, daemon=True)
+        self.process.start()
+        # the server process has its own copy of the listening socket
+        self.sock.close()
+
+    def serve(self):
+        lock = threading.Lock()
+        while True:
+            conn, _ = self.sock.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.handle, args=(conn, lock), daemon=True).start()
+
+    def handle(self, conn, lock):
+        # one thread per worker, a worker leaves by closing its connection
+        numel = self.arena.data.numel()
+        payload_size = self.compressor.payload_size(self.arena.params) if self.compressor else 0
+        buf, flat = flat_buffer(max(numel, payload_size // 4))
+        flat = flat[:numel]
+        with conn:
+            for kind, version in iter(lambda: recv_msg(conn, buf), None):
+                if kind == PULL:
+                    with lock:
+                        flat.copy_(self.arena.data)
+                        version = int(self.counts[0])
+                    # buf may be larger than the weights (room for a compressed payload)
+                    send_msg(conn, WEIGHTS, version, memoryview(buf)[:numel * 4])
+                elif kind == PUSH:
+                    with lock:
+                        accepted = int(self.counts[0]) - version <= self.max_staleness
+                        if accepted:
+                            if self.compressor: self.compressor.decode(self.arena.params, buf)
+                            else: self.arena.grad.copy_(flat)
+                            self.optimizer.step()
+                            self.optimizer.zero_grad()
+                            self.counts[0] += 1
+                        self.counts[1 if accepted else 2] += 1
+                        version = int(self.counts[0])
+                    send_msg(conn, ACCEPTED if accepted else STALE, version)
+
+    def close(self):
+        '''Stop the server process.'''
+        if self.process is not None: self.process.terminate()
+        self.sock.close()
+
+    def __repr__(self):
+        version, accepted, stale = self.counts.tolist()
+        return f'(ParameterServer) address: {self.address}, version: {version}, accepted: {accepted}, stale: {stale}, max_staleness: {self.max_staleness}'
+
+class RemoteOptimizer():
+    def __init__(self, params, address, compressor=None):
+        '''Optimizer of a parameter server worker: step pushes the gradients to the server and pulls the new weights.
+            params: model parameters (packed into a local arena)
+            address: (host, port) of the parameter server
+            compressor: compressor of the pushed gradients, the server must use the same kind (None for raw float32 gradients)
+        '''
+        self.arena, self.compressor = ParameterArena(params), compressor
+        self.buf, self.flat = flat_buffer(self.arena.data.numel())
+        if compressor: self.payload = bytearray(compressor.payload_size(self.arena.params))
+        self.address = address
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.accepted = self.stale = 0
+        self.pull()
+
+    def pull(self):
+        send_msg(self.sock, PULL, 0)
+        _, self.version = self.receive()
+        self.arena.data.copy_(self.flat)
+
+    def step(self):
+        if self.compressor:
+            self.compressor.encode(self.arena.params, self.payload)
+            send_msg(self.sock, PUSH, self.version, self.payload)
+        else:
+            self.flat.copy_(self.arena.grad)
+            send_msg(self.sock, PUSH, self.version, self.buf)
+        kind, _ = self.receive()
+        if kind == ACCEPTED: self.accepted += 1
+        else: self.stale += 1
+        if self.compressor:
+            # error feedback keeps what compression dropped from accepted gradients only
+            if kind == ACCEPTED: self.compressor.commit()
+            else: self.compressor.discard()
+        # stale gradients are dropped, the next batch is computed on the latest weights either way
+        self.pull()
+
+    def receive(self):
+        msg = recv_msg(self.sock, self.buf)
+        # the server process died or closed the connection (ex. its handler thread failed on a message)
+        if msg is None: raise ConnectionError(f'parameter server at {self.address} closed the connection')
+        return msg
+
+    def zero_grad(self): self.arena.zero_grad()
+
+    def close(self): self.sock.close()
+
+    def __repr__(self):
+        return f'(RemoteOptimizer) version: {self.version}, accepted: {self.accepted}, stale: {self.stale}'
\ No newline at end of file
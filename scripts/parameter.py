@@ -17,6 +17,10 @@ class Parameter():
         self.data = data if data != None else torch.Tensor()
         self.requires_grad = requires_grad
         self.grad = 0.
+        # data and grad are views into a ParameterArena (must be modified in-place)
+        self.packed = False
+        # gradients of successive backward passes add up until zero_grad (micro-batches)
+        self.accumulate = False
 
     def __get__(self, instance, owner): return self.data
 
@@ -24,8 +28,56 @@ class Parameter():
 
     def zero_data(self): self.data.zero_()
 
-    def zero_grad(self): self.grad = 0.
+    def zero_grad(self):
+        if self.packed or (self.accumulate and torch.is_tensor(self.grad)): self.grad.zero_()
+        else: self.grad = 0.
 
-    def update(self, grad): self.grad = grad
+    def update(self, grad):
+        if self.accumulate:
+            # summed in-place into a buffer allocated once
+            if not torch.is_tensor(self.grad): self.grad = torch.zeros_like(self.data)
+            self.grad += grad
+        elif self.packed: self.grad.copy_(grad)
+        else: self.grad = grad
 
-    def __repr__(self): return f'shape: {tuple(self.data.shape)}, grad: {self.requires_grad}'
\ No newline at end of file
+    def __repr__(self): return f'shape: {tuple(self.data.shape)}, grad: {self.requires_grad}'
+
+class ParameterArena():
+    def __init__(self, params):
+        '''Pack data and grad of parameters into two contiguous buffers, each Parameter.data/.grad becomes a view into them.
+            params: parameters to pack (ex. model.parameters())
+        '''
+        self.params = list(params)
+        assert not any(p.packed for p in self.params), 'parameter already packed'
+        numels = [p.data.numel() for p in self.params]
+        self.data = torch.zeros(sum(numels))
+        self.grad = torch.zeros(sum(numels))
+
+        start = 0
+        for p, numel in zip(self.params, numels):
+            data = self.data[start: start+numel].view_as(p.data)
+            data.copy_(p.data)
+            p.data = data
+            p.grad = self.grad[start: start+numel].view_as(p.data)
+            p.packed = True
+            start += numel
+
+        # single parameter over the whole arena, optimizers step it with a few vectorized ops
+        self.flat = Parameter(self.data)
+        self.flat.grad, self.flat.packed = self.grad, True
+
+    def parameters(self):
+        # allows arena to be passed wherever a model is expected by optimizers (ex. adam_opt(arena))
+        yield self.flat
+
+    def step(self, learning_rate): self.flat.step(learning_rate)
+
+    def zero_grad(self): self.grad.zero_()
+
+    def snapshot(self): return self.data.clone()
+
+    def load(self, snapshot): self.data.copy_(snapshot)
+
+    def __len__(self): return len(self.params)
+
+    def __repr__(self): return f'(ParameterArena) params: {len(self)}, numel: {self.data.numel()}'
\ No newline at end of file
@@ -0,0 +1,185 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/36_pipeline.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from hogwild import *
+
+def flatten_layers(model):
+    '''Layers of a model with Sequentials and plain sub models (ResNet, ResBlockGroup, ResBlock) unpacked, so that the pipeline can split between them.
+        model: Sequential model or layer
+    '''
+    if isinstance(model, Sequential): return [layer for child in model.layers for layer in flatten_layers(child)]
+    if isinstance(model, SubModel) and type(model).fwd is SubModel.fwd and type(model).bwd is SubModel.bwd:
+        return flatten_layers(model.sub_model)
+    return [model]
+
+def layer_costs(layers, inp):
+    '''Measured time of the forward and backward pass of every layer on inp (parameter gradients and running statistics are left as is).
+        layers: list of layers
+        inp: input batch
+    '''
+    params = [param for layer in layers for param in layer.parameters()]
+    grads = [param.grad.clone() if torch.is_tensor(param.grad) else param.grad for param in params]
+    costs = []
+    with frozen_stats():
+        for layer in layers:
+            start = time.perf_counter()
+            inp = layer(inp)
+            costs.append(time.perf_counter() - start)
+        inp.g = torch.zeros_like(inp)
+        for i, layer in reversed(list(enumerate(layers))):
+            start = time.perf_counter()
+            layer.backward()
+            costs[i] += time.perf_counter() - start
+            layer.free()
+    for param, grad in zip(params, grads):
+        # in-place for parameters in a (shared) arena
+        if param.packed: param.grad.copy_(grad)
+        else: param.grad = grad
+    return costs
+
+def balance(costs, k):
+    '''Split costs into k contiguous parts minimizing the cost of the largest part, returns the sizes of the parts.
+        costs: list of costs
+        k: number of parts
+    '''
+    n = len(costs)
+    assert 0 < k <= n, f'can not split {n} layers into {k} stages'
+    sums = [0.]
+    for c in costs: sums.append(sums[-1] + c)
+    # best[j][i]: largest part of the best split of the first i costs into j parts
+    best = [[float('inf')] * (n+1) for _ in range(k+1)]
+    cut = [[0] * (n+1) for _ in range(k+1)]
+    best[0][0] = 0.
+    for j in range(1, k+1):
+        for i in range(j, n+1):
+            for s in range(j-1, i):
+                largest = max(best[j-1][s], sums[i] - sums[s])
+                if largest < best[j][i]: best[j][i], cut[j][i] = largest, s
+    sizes, i = [], n
+    for j in range(k, 0, -1):
+        sizes.append(i - cut[j][i])
+        i = cut[j][i]
+    return sizes[::-1]
+
+def _stage_worker(layers, rank, jobs, results):
+    '''Worker process of one pipeline stage, runs forward and backward passes of micro-batches until it gets None.
+        layers: Sequential of the layers of the stage
+        rank: index of the stage
+        jobs: queues of (kind, micro-batch index, tensor, batch_stats) of every stage
+        results: queue to the main process (outputs of the last stage, input gradients of the first stage)
+    '''
+    torch.set_num_threads(max(1, torch.get_num_threads() // len(jobs)))
+    # micro-batch inputs kept for backward
+    inputs = {}
+    try:
+        for kind, i, t, batch_stats in iter(jobs[rank].get, None):
+            if kind == 'fwd':
+                # activations are dropped, batch norm trains on the statistics of the micro-batch
+                with no_grad(batch_stats=batch_stats):
+                    out = layers(t)
+                if batch_stats: inputs[i] = t
+                next_stage = jobs[rank+1] if rank+1 < len(jobs) else results
+                next_stage.put(('fwd', i, out, batch_stats))
+            else:
+                inp = inputs.pop(i)
+                # recompute activations (running statistics were already updated in fwd)
+                with frozen_stats():
+                    layers(inp).g = t
+                layers.backward()
+                layers.free()
+                prev_stage = jobs[rank-1] if rank > 0 else results
+                prev_stage.put(('bwd', i, inp.g, batch_stats))
+    except BaseException:
+        results.put(('error', rank, RuntimeError(traceback.format_exc()), None))
+
+class Pipeline():
+    def __init__(self, model, num_stages, micro_batches, inp):
+        '''Pipeline parallel model, layers are split into num_stages worker processes balanced by their measured cost, batches stream through them in micro-batches.
+            model: Sequential model (its parameters, gradients and running statistics are moved to shared memory)
+            num_stages: number of stages (worker processes)
+            micro_batches: number of micro-batches each batch is split into
+            inp: sample batch to measure the cost of the layers with
+        '''
+        self.model = model
+        self.num_stages, self.micro_batches = num_stages, micro_batches
+        self.training = True
+        self.layers = flatten_layers(model)
+        self.costs = layer_costs(self.layers, inp.chunk(micro_batches)[0])
+        self.sizes = balance(self.costs, num_stages)
+        # optimizer of the main process steps the shared parameters, stages add up the gradients of the micro-batches
+        self.arena = ParameterArena(model.parameters())
+        self.arena.data.share_memory_()
+        self.arena.grad.share_memory_()
+        for param in self.arena.params: param.accumulate = True
+        for t in running_stats(model): t.share_memory_()
+        self.workers = []
+
+    def start(self):
+        '''Fork the stage processes.'''
+        self.jobs, self.results = [mp.Queue() for _ in range(self.num_stages)], mp.Queue()
+        start = 0
+        for rank, size in enumerate(self.sizes):
+            layers = Sequential(self.layers[start: start+size])
+            self.workers.append(mp.Process(target=_stage_worker, args=(layers, rank, self.jobs, self.results), daemon=True))
+            start += size
+        for worker in self.workers: worker.start()
+
+    def close(self):
+        '''Stop the stage processes.'''
+        for job in self.jobs: job.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive(): worker.terminate()
+        self.workers = []
+
+    def gather(self):
+        # results of the micro-batches arrive out of order
+        results = {}
+        while len(results) < self.num_chunks:
+            try: got, i, t, _ = get_alive(self.results, self.workers)
+            except RuntimeError:
+                self.close()
+                raise
+            if got == 'error':
+                self.close()
+                raise t
+            results[i] = t
+        return [results[i] for i in range(self.num_chunks)]
+
+    def __call__(self, inp):
+        if not self.workers: self.start()
+        # evaluated models run in inference mode (no micro-batch inputs kept for backward)
+        with no_grad(not self.training):
+            batch_stats = grad_enabled() and use_batch_stats()
+        chunks = inp.chunk(self.micro_batches)
+        # fewer chunks for batches smaller than micro_batches
+        self.num_chunks = len(chunks)
+        for i, chunk in enumerate(chunks): self.jobs[0].put(('fwd', i, chunk, batch_stats))
+        out = torch.cat(self.gather())
+        self.inp, self.out = (inp, out) if batch_stats else (None, None)
+        return out
+
+    def backward(self):
+        for i, g in reversed(list(enumerate(self.out.g.chunk(self.num_chunks)))):
+            self.jobs[-1].put(('bwd', i, g, True))
+        self.inp.g = torch.cat(self.gather())
+
+    def train(self): self.training = True
+
+    def eval_(self): self.training = False
+
+    def free(self): self.inp = self.out = None
+
+    def parameters(self): return self.model.parameters()
+
+    def __repr__(self, t=''):
+        costs, start = [], 0
+        for size in self.sizes:
+            costs.append(sum(self.costs[start: start+size]) * 1e3)
+            start += size
+        return f"(Pipeline) stages: {self.sizes} layers, {[round(c, 1) for c in costs]}ms, micro_batches: {self.micro_batches}\n{self.model.__repr__(t)}"
\ No newline at end of file
@@ -10,7 +10,7 @@ from convolution import *
 
 class MaxPool(Module):
     def __init__(self, k_s=3, stride=1, pad=0):
-        '''Max Pooling layer.
+        '''Max Pooling layer (caches argmax indices in fwd, routes gradient with one scatter in bwd).
             k_s: kernel size
             stride: stride size
             pad: padding size
@@ -19,42 +19,89 @@ class MaxPool(Module):
         self.k_s, self.stride, self.pad = k_s, stride, pad
 
     def fwd(self, inp):
-        batch_size, in_c, in_h, in_w = inp.shape
-        out_dim = lambda d: (d + 2 * self.pad - self.k_s) // self.stride + 1
-        out_c, out_h, out_w = in_c, out_dim(in_h), out_dim(in_w)
-
-        padded = pad_tensor(inp, self.pad, inp.min()) if self.pad > 0 else inp
-        out = torch.zeros(batch_size, out_c, out_h, out_w)
-        for i in range(out_h):
-            for j in range(out_w):
-                i_s, j_s = i * self.stride, j * self.stride
-                in_window = padded[:, :, i_s: i_s+self.k_s, j_s: j_s+self.k_s]
-                out[:,:,i,j] = in_window.max(-1)[0].max(-1)[0]
+        padded = pad_tensor(inp, self.pad, float('-inf')) if self.pad > 0 else inp
+        batch_size, c, p_h, p_w = padded.shape
+        # strided window view (batch, c, out_h, out_w, k_s, k_s), no copy
+        windows = padded.unfold(2, self.k_s, self.stride).unfold(3, self.k_s, self.stride)
+        out_h, out_w = windows.shape[2:4]
+
+        # running max over kernel offsets keeps every temporary at output size
+        out = torch.full(windows.shape[:4], float('-inf'), out=self.buffer('out', windows.shape[:4]))
+        offset = torch.zeros(out.shape, dtype=torch.long)
+        for k in range(self.k_s ** 2):
+            cur = windows[..., k // self.k_s, k % self.k_s]
+            mask = cur > out
+            torch.where(mask, cur, out, out=out)
+            offset.masked_fill_(mask, k)
+
+        if not grad_enabled():
+            self.idxs = None
+            return out
+
+        # flat index of each max into the padded input plane
+        rows = torch.arange(out_h)[:, None] * self.stride + offset // self.k_s
+        cols = torch.arange(out_w)[None, :] * self.stride + offset % self.k_s
+        self.idxs = (rows * p_w + cols).view(batch_size, c, -1)
+        self.padded_shape = padded.shape
         return out
 
     def bwd(self, out, inp):
-        dL = out.g
-        batch_size, out_c, out_h, out_w = dL.shape
-
-        padded = pad_tensor(inp, self.pad, inp.min()) if self.pad > 0 else inp
-        dX = torch.zeros_like(padded)
-        for i in range(out_h):
-            for j in range(out_w):
-                i_s, j_s = i*stride, j*stride
-                inp_w = padded[:, :, i_s:i_s+k_s, j_s:j_s+k_s]
-                mask = torch.zeros_like(inp_w)
-                for i in range(mask.shape[0]):
-                    for j in range(mask.shape[1]):
-                        mask[i,j,:,:] = inp_w[i,j,:,:] == inp_w[i,j,:,:].max()
-                dX[:, :, i_s:i_s+k_s, j_s:j_s+k_s] += dL[:,:,i,j][...,None,None] * mask
-        padded.g = dX
+        batch_size, c, p_h, p_w = self.padded_shape
+        dX = torch.zeros((batch_size, c, p_h * p_w), out=self.buffer('grad', (batch_size, c, p_h * p_w)))
+        dX.scatter_add_(-1, self.idxs, out.g.reshape(batch_size, c, -1))
+        dX = dX.view(self.padded_shape)
+        inp.g = dX if self.pad == 0 else dX[:, :, self.pad: -self.pad, self.pad: -self.pad]
+
+    def free(self):
+        super().free()
+        self.idxs = None
 
     def __repr__(self, t=''):
         return f"{t+'    '}MaxPool({self.k_s}, {self.stride})"
 
+def window_sums(inp, k_s, stride):
+    '''Sum of every (k_s, k_s) window of inp with a summed-area table (constant lookups per window).
+        inp: (padded) input data
+        k_s: square kernel size
+        stride: stride size
+    '''
+    batch_size, c, h, w = inp.shape
+    out_h, out_w = (h - k_s) // stride + 1, (w - k_s) // stride + 1
+    # table[..., y, x] = sum of inp[..., :y, :x], with a leading row/col of zeros
+    # float64: window sums are differences of large prefix sums, float32 would lose most of their precision
+    table = torch.zeros(batch_size, c, h+1, w+1, dtype=torch.float64)
+    table[:, :, 1:, 1:] = inp.double().cumsum(2).cumsum(3)
+
+    y0, y1 = slice(0, stride*out_h, stride), slice(k_s, k_s+stride*out_h, stride)
+    x0, x1 = slice(0, stride*out_w, stride), slice(k_s, k_s+stride*out_w, stride)
+    return (table[:, :, y1, x1] - table[:, :, y0, x1] - table[:, :, y1, x0] + table[:, :, y0, x0]).to(inp.dtype)
+
+def window_sums_bwd(dL, shape, k_s, stride):
+    '''Gradient of window_sums w.r.t. its input (every input cell receives the sum of dL over windows covering it).
+        dL: gradient of window sums
+        shape: (padded) input shape
+        k_s: square kernel size
+        stride: stride size
+    '''
+    batch_size, c, h, w = shape
+    _, _, out_h, out_w = dL.shape
+    y0, y1 = slice(0, stride*out_h, stride), slice(k_s, k_s+stride*out_h, stride)
+    x0, x1 = slice(0, stride*out_w, stride), slice(k_s, k_s+stride*out_w, stride)
+
+    # scatter dL onto the four table corners of each window (adjoint of the lookups)
+    corners = torch.zeros(batch_size, c, h+1, w+1, dtype=torch.float64)
+    corners[:, :, y1, x1] += dL
+    corners[:, :, y0, x1] -= dL
+    corners[:, :, y1, x0] -= dL
+    corners[:, :, y0, x0] += dL
+
+    # adjoint of the cumsums: reversed cumsum, input cell (y, x) reads table entries (> y, > x)
+    corners = corners.flip((2, 3)).cumsum(2).cumsum(3).flip((2, 3))
+    return corners[:, :, 1:, 1:].to(dL.dtype)
+
 class AvgPool(Module):
     def __init__(self, k_s=3, stride=1, pad=0):
-        '''Average Pooling layer.
+        '''Average Pooling layer (summed-area table, so cost per window does not depend on kernel size).
             k_s: kernel size
             stride: stride size
             pad: padding size
@@ -63,34 +110,32 @@ class AvgPool(Module):
         self.k_s, self.stride, self.pad = k_s, stride, pad
 
     def fwd(self, inp):
-        batch_size, in_c, in_h, in_w = inp.shape
-        out_dim = lambda d: (d + 2 * self.pad - self.k_s) // self.stride + 1
-        out_c, out_h, out_w = in_c, out_dim(in_h), out_dim(in_w)
-
         padded = pad_tensor(inp, self.pad) if self.pad > 0 else inp
-        out = torch.zeros(batch_size, out_c, out_h, out_w)
-        for i in range(out_h):
-            for j in range(out_w):
-                i_s, j_s = i * self.stride, j * self.stride
-                in_window = padded[:, :, i_s: i_s+self.k_s, j_s: j_s+self.k_s]
-                out[:,:,i,j] = torch.mean(in_window, (-1, -2))
-        return out
+        sums = window_sums(padded, self.k_s, self.stride)
+        return torch.div(sums, self.k_s ** 2, out=self.buffer('out', sums.shape))
 
     def bwd(self, out, inp):
-        dL = out.g
-        batch_size, out_c, out_h, out_w = dL.shape
-
-        padded = pad_tensor(inp, self.pad) if self.pad > 0 else inp
-        dX = torch.zeros_like(padded)
-        for i in range(out_h):
-            for j in range(out_w):
-                i_s, j_s = i*self.stride, j*self.stride
-                dX[:, :, i_s:i_s+self.k_s, j_s:j_s+self.k_s] += dL[:,:,i,j][...,None,None] / (self.k_s ** 2)
-        padded.g = dX
+        padded_shape = (*inp.shape[:2], inp.shape[2] + 2*self.pad, inp.shape[3] + 2*self.pad)
+        dX = window_sums_bwd(out.g / (self.k_s ** 2), padded_shape, self.k_s, self.stride)
+        inp.g = dX if self.pad == 0 else dX[:, :, self.pad: -self.pad, self.pad: -self.pad]
 
     def __repr__(self, t=''):
         return f"{t+'    '}AvgPool({self.k_s}, {self.stride})"
 
+class GlobalAvgPool(Module):
+    def __init__(self):
+        '''Global Average Pooling layer (average over the whole feature map, output is (batch, c, 1, 1)).'''
+        super().__init__()
+
+    def fwd(self, inp):
+        return torch.mean(inp, (2, 3), keepdim=True, out=self.buffer('out', (*inp.shape[:2], 1, 1)))
+
+    def bwd(self, out, inp):
+        inp.g = torch.div(out.g.expand_as(inp), inp.shape[2] * inp.shape[3], out=self.buffer('grad', inp.shape))
+
+    def __repr__(self, t=''):
+        return f"{t+'    '}GlobalAvgPool()"
+
 def get_conv_pool_model(data_bunch):
     '''Util function to get convolution model with average pooling.
         data_bunch: data bunch with training and validation data
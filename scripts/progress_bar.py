@@ -6,17 +6,17 @@
 import sys
 sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
 
-from fastprogress import master_bar, progress_bar
-from fastprogress.fastprogress import format_time
 from early_stopping import *
 
+fastprogress = LazyModule('fastprogress.fastprogress')
+
 class ProgressViewer(Callback):
     def __init__(self):
         '''Callback utilizing FastAI frontend lib to display neat looking training progress.'''
         super().__init__()
 
     def before_fit(self):
-        self.mbar = master_bar(range(self.num_epochs))
+        self.mbar = fastprogress.master_bar(range(self.num_epochs))
         self.mbar.on_iter_begin()
         self.learner.logger = partial(self.mbar.write, table=True)
 
@@ -27,7 +27,7 @@ class ProgressViewer(Callback):
         self.pb.update(self.iters_count)
 
     def set_pb(self, data_loader):
-        self.pb = progress_bar(data_loader, parent=self.mbar)
+        self.pb = fastprogress.progress_bar(data_loader, parent=self.mbar)
         self.mbar.update(self.epoch)
 
     def before_epoch(self):
@@ -8,46 +8,129 @@ sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
 
 from stateful_optim import *
 
-def get_basic_block(i, o, s):
+class ConvBNReLU(Module):
+    def __init__(self, c_in, c_out, k_s=3, stride=1, pad=0, relu=True):
+        '''Conv, BatchNorm and ReLU fused in one layer, batch norm and activation are applied in place and only the normalized conv output is kept for bwd.
+            c_in: channel in
+            c_out: channel out
+            k_s: square kernel size
+            stride: stride size
+            pad: padding size
+            relu: whether to end with a ReLU (else only Conv and BatchNorm)
+        '''
+        super().__init__()
+        self.conv = Conv(c_in, c_out, k_s, stride, pad)
+        self.bn = BatchNorm(c_out)
+        self.relu = relu
+
+    def parameters(self):
+        for layer in [self.conv, self.bn]:
+            for param in layer.parameters():
+                yield param
+
+    def fwd(self, inp):
+        bn, out = self.bn, self.conv(inp)
+        self.x_hat = self.inv_std = None
+        if not use_batch_stats():
+            # inference: normalize with running statistics in place
+            scale = bn.gamma.data * (bn.var + bn.epsilon).rsqrt()
+            out = torch.addcmul(bn.beta.data - bn.mean * scale, out, scale, out=out)
+        else:
+            mean, var = bn.update_stats(out)
+            inv_std = (var + bn.epsilon).rsqrt()
+            # conv output is normalized in place, it is the only activation kept for bwd
+            x_hat = out.sub_(mean).mul_(inv_std)
+            if grad_enabled():
+                self.x_hat, self.inv_std = x_hat, inv_std
+                out = torch.addcmul(bn.beta.data, bn.gamma.data, x_hat, out=self.buffer('out', x_hat.shape))
+            else:
+                out = torch.addcmul(bn.beta.data, bn.gamma.data, x_hat, out=x_hat)
+        return out.clamp_min_(0.).sub_(0.5) if self.relu else out
+
+    def bwd(self, out, inp):
+        bn, x_hat, dL = self.bn, self.x_hat, out.g
+        if self.relu:
+            # activation mask is recomputed from the normalized conv output
+            dL = dL * (torch.addcmul(bn.beta.data, bn.gamma.data, x_hat) > 0)
+        dLdg = (dL * x_hat).sum((0,2,3), keepdim=True)
+        dLdb = dL.sum((0,2,3), keepdim=True)
+        bn.gamma.update(dLdg)
+        bn.beta.update(dLdb)
+
+        # batch norm closed form (see BatchNorm.bwd) written over the normalized conv output
+        n = dL.numel() // dL.shape[1]
+        x_hat.g = x_hat.mul_(dLdg / n).neg_().add_(dL).sub_(dLdb / n).mul_(bn.gamma.data * self.inv_std)
+        self.conv.backward()
+        # x_hat is the conv output and its own gradient now, break the reference cycle
+        x_hat.g = self.x_hat = self.inv_std = None
+
+    def free(self):
+        super().free()
+        self.x_hat = self.inv_std = None
+        self.conv.free()
+
+    def __repr__(self, t=''):
+        c = self.conv
+        return f"{t+'    '}ConvBN{'ReLU' if self.relu else ''}({c.c_in}, {c.c_out}, {c.k_s}, {c.stride})"
+
+def get_basic_block(i, o, s, fused=False):
     '''Get basic ResNet block.
         i: channel in
         o: channel out
         s: stride size
+        fused: whether to use fused ConvBNReLU layers
     '''
-    return Sequential(Conv(i, o, 3, s),
+    if fused:
+        return Sequential(ConvBNReLU(i, o, 3, s, 1),
+                          ConvBNReLU(o, o, 3, 1, 1, relu=False))
+    return Sequential(Conv(i, o, 3, s, 1),
                       BatchNorm(o),
                       ReLU(),
-                      Conv(o, o*4, 3, 1),
+                      Conv(o, o, 3, 1, 1),
                       BatchNorm(o))
 
-def get_bottleneck(i, o):
+def get_bottleneck(i, o, s, fused=False):
     '''Get bottleneck ResNet block.
         i: channel in
-        o: channel out
+        o: channel out (before the 4 times expansion)
+        s: stride size
+        fused: whether to use fused ConvBNReLU layers
     '''
+    if fused:
+        return Sequential(ConvBNReLU(i, o, 1, 1),
+                          ConvBNReLU(o, o, 3, s, 1),
+                          ConvBNReLU(o, o*4, 1, 1, relu=False))
     return Sequential(Conv(i, o, 1, 1),
                       BatchNorm(o),
                       ReLU(),
-                      Conv(o, o, 3, 1),
+                      Conv(o, o, 3, s, 1),
                       BatchNorm(o),
                       ReLU(),
                       Conv(o, o*4, 1, 1),
-                      BatchNorm(o))
+                      BatchNorm(o*4))
 
 class ResLayer(Module):
-    def __init__(self, i, o, s, bottleneck):
+    def __init__(self, i, o, s, bottleneck, fused=False):
         '''Get ResLayer (almost a ResBlock but not including the final activation).
             i: channel in
             o: channel out
             s: stride size
             bottleneck: boolean of whether the resblock is basic or bottleneck
+            fused: whether to use fused ConvBNReLU layers (conv, batch norm and activation in one fwd/bwd)
         '''
         super().__init__()
         self.i, self.o, self.s, self.bottleneck = i, o, s, bottleneck
-        self.x_layer = Identity()
-        self.Fx_layer = get_bottleneck(i, o) if bottleneck else get_basic_block(self.i, self.o, self.s)
+        c_out = o*4 if bottleneck else o
+        # projection shortcut when the block changes the shape of its input
+        if i == c_out and s == 1: self.x_layer = Identity()
+        elif fused:               self.x_layer = Sequential(ConvBNReLU(i, c_out, 1, s, relu=False))
+        else:                     self.x_layer = Sequential(Conv(i, c_out, 1, s), BatchNorm(c_out))
+        self.Fx_layer = get_bottleneck(i, o, s, fused) if bottleneck else get_basic_block(i, o, s, fused)
 
     def fwd(self, inp):
+        if not grad_enabled():
+            self.fx = self.x = None
+            return self.Fx_layer(inp) + self.x_layer(inp)
         self.fx = self.Fx_layer(inp)
         self.x = self.x_layer(inp)
         self.out = self.fx + self.x
@@ -55,9 +138,21 @@ class ResLayer(Module):
 
     def bwd(self, out, inp):
         self.fx.g = out.g
-        self.x.g = out.g
         self.Fx_layer.backward()
-        self.x_layer.backward()
+        dfx = inp.g
+        # an identity shortcut passes out.g through (self.x is inp itself), a projection computes its own input gradient
+        if isinstance(self.x_layer, Identity):
+            inp.g = dfx + out.g
+        else:
+            self.x.g = out.g
+            self.x_layer.backward()
+            inp.g = inp.g + dfx
+
+    def free(self):
+        super().free()
+        self.fx = self.x = None
+        self.Fx_layer.free()
+        self.x_layer.free()
 
     def parameters(self):
         for sub_model in [self.Fx_layer, self.x_layer]:
@@ -65,42 +160,50 @@ class ResLayer(Module):
                 yield param
 
 class ResBlock(SubModel):
-    def __init__(self, i, o, s, bottleneck):
+    def __init__(self, i, o, s, bottleneck, fused=False):
         '''ResBlock (ResLayer + Activation).
             i: channel in
             o: channel out
             s: stride size
             bottleneck: boolean of whether the resblock is basic or bottleneck
+            fused: whether to use fused ConvBNReLU layers
         '''
         super().__init__()
         self.i, self.o, self.s, self.bottleneck = i, o, s, bottleneck
-        self.sub_model = Sequential(ResLayer(i, o, s, bottleneck),
+        self.sub_model = Sequential(ResLayer(i, o, s, bottleneck, fused),
                                     ReLU())
 
     def __repr__(self, t=''):
         return f"{t+'    '}{'Bottleneck' if self.bottleneck else 'BasicBlock'}({self.i}, {self.o}, {self.s})"
 
 class ResBlockGroup(SubModel):
-    def __init__(self, i, o, num_blocks, bottleneck):
+    def __init__(self, i, o, num_blocks, bottleneck, checkpoint=0, fused=False):
         '''Group of ResBlocks.
             i: channel in
             o: channel out
             num_blocks: number of resblockss
             bottleneck: boolean of whether the resblocks are basic or bottleneck
+            checkpoint: number of resblocks per checkpointed segment (0 to keep every activation)
+            fused: whether to use fused ConvBNReLU layers
         '''
-        layers = [ResBlock(i, o, 2, bottleneck)]
+        layers = [ResBlock(i, o, 2, bottleneck, fused)]
         for _ in range(num_blocks-1):
-            layers.append(ResBlock(o, o, 1, bottleneck))
-        self.sub_model = Sequential(*layers)
+            layers.append(ResBlock(o*4 if bottleneck else o, o, 1, bottleneck, fused))
+        self.sub_model = Sequential(checkpoint_segments(layers, checkpoint))
 
     def __repr__(self, t=''):
         return f"{self.sub_model.__repr__(t+'    ')}"
 
-def get_res_head(in_shape, o):
+def get_res_head(in_shape, o, fused=False):
     '''ResNet head (before ResBlocks).
         in_shape: input shape before conv bn relu and pool
         o: channel out
+        fused: whether to use a fused ConvBNReLU layer
     '''
+    if fused:
+        return [Reshape(in_shape),
+                ConvBNReLU(in_shape[0], o, 7, 2),
+                MaxPool(3, 2, 1)]
     return [Reshape(in_shape),
             Conv(in_shape[0], o, 7, 2),
             BatchNorm(o),
@@ -112,7 +215,7 @@ def get_res_tail(h, o):
         h: number of hidden cells
         o: channel out
     '''
-    return [AvgPool(1, 1, 0),
+    return [GlobalAvgPool(),
             Flatten(),
             Linear(h, o, True)]
 
@@ -123,22 +226,25 @@ name2depths = {18:  [2, 2, 2,  2],
                152: [3, 8, 36, 3]}
 
 class ResNet(SubModel):
-    def __init__(self, n_layer, in_shape=(3,28,28), out=100):
+    def __init__(self, n_layer, in_shape=(3,28,28), out=100, checkpoint=0, fused=False):
         '''ResNet model that is able to create ResNets with different number of layers adaptively.
             n_layer: number of resnet layers (18, 34...)
             in_shape: input image shape
             out: output number of labels
+            checkpoint: number of resblocks per checkpointed segment (0 to keep every activation)
+            fused: whether to use fused ConvBNReLU layers
         '''
         self.name = f'ResNet {n_layer}'
         bottleneck = n_layer > 34
+        expansion = 4 if bottleneck else 1
         channels = [64, 128, 256, 512]
         depths = name2depths[n_layer]
 
-        head = get_res_head(in_shape, channels[0])
-        body = [ResBlockGroup(channels[0], channels[0], depths[0], bottleneck)]
+        head = get_res_head(in_shape, channels[0], fused)
+        body = [ResBlockGroup(channels[0], channels[0], depths[0], bottleneck, checkpoint, fused)]
         for i, o, depth in zip(channels, channels[1:], depths[1:]):
-            body.append(ResBlockGroup(i, o, depth, bottleneck))
-        tail = get_res_tail(channels[-1]*(4 if bottleneck else 1), out)
+            body.append(ResBlockGroup(i*expansion, o, depth, bottleneck, checkpoint, fused))
+        tail = get_res_tail(channels[-1]*expansion, out)
         self.sub_model = Sequential(head + body + tail)
 
     def __repr__(self, t=''):
@@ -191,4 +191,97 @@ def lamb_opt(model, beta1=0.9, beta2=0.99, **kwargs):
     '''
     return StatefulOpt(list(model.parameters()), [lamb_step],
                        [ExpWeightedGrad(True), ExpWeightedSqrGrad(), StepCount()],
-                       mom=beta1, sqr_mom=beta2, **kwargs)
\ No newline at end of file
+                       mom=beta1, sqr_mom=beta2, **kwargs)
+
+class FusedAdam():
+    def __init__(self, params, **hyper_params):
+        '''Adam (+ weight decay) updating moments, debiasing and stepping all parameters of a group with multi-tensor ops.
+            params: model parameters
+            hyper_params: hyper parameters (learning_rate, mom, sqr_mom, weight_decay, eps)
+        '''
+        self.params = [params] if isinstance(params, list) else [[params]]
+        self.hypers = [dict(hyper_params) for p in self.params]
+        # one state per group of parameters (lists of moment tensors instead of a dict per parameter)
+        self.state = [None for p in self.params]
+
+    def _init_state(self, params):
+        return {'avg_grad': [torch.zeros_like(p.grad) for p in params],
+                'sqr_avg_grad': [torch.zeros_like(p.grad) for p in params],
+                'step': 0}
+
+    def _update_state(self, state, grads, mom, sqr_mom, **kwargs):
+        # same as ExpWeightedGrad(True), ExpWeightedSqrGrad() and StepCount()
+        torch._foreach_mul_(state['avg_grad'], mom)
+        torch._foreach_add_(state['avg_grad'], grads, alpha=1.-mom)
+        torch._foreach_mul_(state['sqr_avg_grad'], sqr_mom)
+        torch._foreach_addcmul_(state['sqr_avg_grad'], grads, grads, value=1.-sqr_mom)
+        state['step'] += 1
+
+    def _denom(self, state, sqr_mom, eps=1e-5, **kwargs):
+        denom = torch._foreach_div(state['sqr_avg_grad'], debias(sqr_mom, 1.-sqr_mom, state['step']))
+        torch._foreach_sqrt_(denom)
+        torch._foreach_add_(denom, eps)
+        return denom
+
+    def _step_group(self, datas, grads, state, learning_rate, mom, weight_decay=0., **hyper_params):
+        # same as adam followed by l2_reg
+        denom = self._denom(state, **hyper_params)
+        torch._foreach_addcdiv_(datas, state['avg_grad'], denom, value=-learning_rate/debias(mom, 1.-mom, state['step']))
+        if weight_decay: torch._foreach_add_(grads, datas, alpha=weight_decay)
+
+    def step(self):
+        for i, (params, hyper_params) in enumerate(zip(self.params, self.hypers)):
+            if self.state[i] is None:
+                self.state[i] = self._init_state(params)
+            datas, grads = [p.data for p in params], [p.grad for p in params]
+            self._update_state(self.state[i], grads, **hyper_params)
+            self._step_group(datas, grads, self.state[i], **hyper_params)
+
+    def zero_grad(self):
+        for hps in self.params:
+            for hp in hps:
+                hp.zero_grad()
+
+    def __repr__(self):
+        return f'({self.__class__.__name__}) groups: {len(self.params)}, hyper_params: {list(self.hypers[0])}'
+
+class FusedLamb(FusedAdam):
+    def __init__(self, params, **hyper_params):
+        '''LAMB with multi-tensor ops (layer-wise trust ratio computed from per parameter norms).
+            params: model parameters
+            hyper_params: hyper parameters (learning_rate, mom, sqr_mom, weight_decay, eps)
+        '''
+        super().__init__(params, **hyper_params)
+
+    def _step_group(self, datas, grads, state, learning_rate, mom, weight_decay, **hyper_params):
+        # same as lamb_step
+        denom = self._denom(state, **hyper_params)
+        steps = torch._foreach_div(state['avg_grad'], debias(mom, 1.-mom, state['step']))
+        torch._foreach_div_(steps, denom)
+        torch._foreach_add_(steps, datas, alpha=weight_decay)
+
+        # root mean square of each parameter and step, then trust ratio capped at 10
+        sqrt_numels = torch.tensor([p.numel() for p in datas], dtype=torch.float).sqrt()
+        r1 = torch.stack(torch._foreach_norm(datas)) / sqrt_numels
+        r2 = torch.stack(torch._foreach_norm(steps)) / sqrt_numels
+        scales = (r1 / r2).clamp_max(10.) * -learning_rate
+        torch._foreach_mul_(steps, list(scales.unbind()))
+        torch._foreach_add_(datas, steps)
+
+def fused_adam_opt(model, beta1=0.9, beta2=0.99, **kwargs):
+    '''Util function to get fused adam optimizer (equivalent to adam_opt).
+        model: training model
+        beta1: adam weighting coefficient (https://arxiv.org/abs/1412.6980)
+        beta2: adam weight coefficient
+        kwargs: other optimizer internal variables
+    '''
+    return FusedAdam(list(model.parameters()), mom=beta1, sqr_mom=beta2, **kwargs)
+
+def fused_lamb_opt(model, beta1=0.9, beta2=0.99, **kwargs):
+    '''Util function to get fused LAMB optimizer (equivalent to lamb_opt).
+        model: training model
+        beta1: adam/lamb weighting coefficient (https://arxiv.org/abs/1904.00962)
+        beta2: adam/lamb weight coefficient
+        kwargs: other optimizer internal variables
+    '''
+    return FusedLamb(list(model.parameters()), mom=beta1, sqr_mom=beta2, **kwargs)
\ No newline at end of file
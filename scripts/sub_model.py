@@ -21,4 +21,39 @@ class SubModel(Module):
 
     def bwd(self, out, inp): self.sub_model.backward()
 
-    def __repr__(self, t): return self.sub_model.__repr__(t+'    ')
\ No newline at end of file
+    def free(self):
+        super().free()
+        self.sub_model.free()
+
+    def __repr__(self, t): return self.sub_model.__repr__(t+'    ')
+
+class Checkpoint(SubModel):
+    def __init__(self, *layers):
+        '''Checkpointed segment, keeps only its input in fwd and recomputes its activations right before bwd.
+            layers: layers of the segment
+        '''
+        super().__init__()
+        self.sub_model = Sequential(*layers)
+
+    def fwd(self, inp):
+        # activations of the segment are dropped, batch norm still trains on batch statistics
+        with no_grad(grad_enabled(), batch_stats=use_batch_stats()):
+            return self.sub_model(inp)
+
+    def bwd(self, out, inp):
+        # recompute activations (running statistics were already updated in fwd)
+        with frozen_stats():
+            self.sub_model(inp).g = out.g
+        self.sub_model.backward()
+        self.sub_model.free()
+
+    def __repr__(self, t=''):
+        return f"{t+'    '}Checkpoint\n{self.sub_model.__repr__(t+'    ')}"
+
+def checkpoint_segments(layers, k):
+    '''Group layers into checkpointed segments of k layers (no checkpointing if k is 0).
+        layers: list of layers
+        k: number of layers per segment
+    '''
+    if not k: return layers
+    return [Checkpoint(*layers[i:i+k]) for i in range(0, len(layers), k)]
\ No newline at end of file
@@ -0,0 +1,151 @@
+# ---------------------------------------------
+# | THIS FILE WAS AUTOGENERATED! DO NOT EDIT! |
+# ---------------------------------------------
+# edit notebooks/37_tensor_parallel.ipynb and run generate_all.py
+
+import sys
+sys.path.insert(0, '/'.join(sys.path[0].split('/')[:-1] + ['scripts']))
+
+from pipeline import *
+
+def _shard_worker(layer, rank, jobs, results):
+    '''Worker process of a ShardedLinear, computes its shard of the forward and backward passes it receives until it gets None.
+        layer: ShardedLinear (forked copy)
+        rank: index of the shard
+        jobs: queue of (kind, tensors) for this worker
+        results: queue of (rank, shard views, error or None) shared by all workers
+    '''
+    torch.set_num_threads(max(1, torch.get_num_threads() // layer.num_workers))
+    try:
+        params = layer.shard_params(rank)
+        # the worker allocates its shard, workers restarted after close inherit the shards already in shared memory
+        if not params[0].packed:
+            arena = ParameterArena(params)
+            arena.data.share_memory_()
+            arena.grad.share_memory_()
+        layer.w = [w if r == rank else None for r, w in enumerate(layer.w)]
+        if layer.mode == 'column': layer.b = [b if r == rank else None for r, b in enumerate(layer.b)]
+        results.put((rank, [(param.data, param.grad) for param in params]))
+        for kind, tensors in iter(jobs.get, None):
+            getattr(layer, f'{kind}_shard')(rank, *tensors)
+            results.put((rank, None))
+    except BaseException:
+        results.put((rank, RuntimeError(traceback.format_exc())))
+
+class ShardedLinear(Module):
+    def __init__(self, in_dim, num_hidden, num_workers=2, mode='column', end=False):
+        '''Linear layer with weights split over num_workers processes, which compute fwd and bwd in parallel (initialized like Linear).
+            in_dim: number of input features
+            num_hidden: number of output features
+            num_workers: number of worker processes (shards)
+            mode: 'column' to split the output features, 'row' to split the input features
+            end: boolean indicating whether layer is end of model (not followed by ReLU activation)
+        '''
+        super().__init__()
+        assert mode in ['column', 'row'], f'unknown mode {mode}'
+        self.in_dim, self.num_hidden, self.num_workers, self.mode = in_dim, num_hidden, num_workers, mode
+        w, b = init_weight(in_dim, num_hidden, end), init_bias(num_hidden)
+        dim = 1 if mode == 'column' else 0
+        # split features of each shard
+        self.bounds = [(w.shape[dim] * r // num_workers, w.shape[dim] * (r+1) // num_workers) for r in range(num_workers)]
+        self.w = [Parameter(w.narrow(dim, s, e-s).clone()) for s, e in self.bounds]
+        # column shards have their part of the bias, the full bias is added to the summed outputs of row shards
+        self.b = [Parameter(b[s:e].clone()) for s, e in self.bounds] if mode == 'column' else [Parameter(b)]
+        self.workers, self.shared = [], {}
+
+    def parameters(self):
+        for param in self.w + self.b:
+            yield param
+
+    def shard_params(self, rank):
+        # the bias of row shards is added by the main process
+        return [self.w[rank], self.b[rank]] if self.mode == 'column' else [self.w[rank]]
+
+    def start(self):
+        '''Fork the worker processes, each allocates its shard and gradient in shared memory (the main process keeps views of them for the optimizer).'''
+        self.jobs, self.results = [mp.Queue() for _ in range(self.num_workers)], mp.Queue()
+        self.workers = [mp.Process(target=_shard_worker, args=(self, rank, self.jobs[rank], self.results), daemon=True)
+                        for rank in range(self.num_workers)]
+        for worker in self.workers: worker.start()
+        for rank, shard in self.collect():
+            for param, (data, grad) in zip(self.shard_params(rank), shard):
+                param.data, param.grad, param.packed = data, grad, True
+
+    def close(self):
+        '''Stop the worker processes.'''
+        for job in self.jobs: job.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive(): worker.terminate()
+        self.workers = []
+
+    def buffer_shared(self, name, shape):
+        # shared tensors are reused for every batch of the same shape (handles are only mapped once by the workers)
+        if (name, shape) not in self.shared: self.shared[(name, shape)] = torch.empty(shape).share_memory_()
+        return self.shared[(name, shape)]
+
+    def collect(self):
+        # one result of every worker, ordered by rank
+        try: results = sorted(get_alive(self.results, self.workers) for _ in self.jobs)
+        except RuntimeError:
+            self.close()
+            raise
+        errors = [result for _, result in results if isinstance(result, Exception)]
+        if errors:
+            self.close()
+            raise errors[0]
+        return results
+
+    def run(self, kind, *tensors):
+        if not self.workers: self.start()
+        for job in self.jobs: job.put((kind, tensors))
+        self.collect()
+
+    def fwd(self, inp):
+        batch_size = inp.shape[0]
+        x = self.buffer_shared('inp', inp.shape)
+        x.copy_(inp)
+        if self.mode == 'column':
+            out = self.buffer_shared('out', (batch_size, self.num_hidden))
+            self.run('fwd', x, out)
+            return out.clone()
+        partials = self.buffer_shared('partials_out', (self.num_workers, batch_size, self.num_hidden))
+        self.run('fwd', x, partials)
+        return partials.sum(0).add_(self.b[0].data)
+
+    def bwd(self, out, inp):
+        batch_size = inp.shape[0]
+        x, g = self.buffer_shared('inp', inp.shape), self.buffer_shared('out_g', out.g.shape)
+        # input of the batch may have been overwritten by another fwd since (ex. validation)
+        x.copy_(inp)
+        g.copy_(out.g)
+        if self.mode == 'column':
+            partials = self.buffer_shared('partials_g', (self.num_workers, batch_size, self.in_dim))
+            self.run('bwd', x, g, partials)
+            inp.g = partials.sum(0)
+        else:
+            inp_g = self.buffer_shared('inp_g', inp.shape)
+            self.run('bwd', x, g, inp_g)
+            inp.g = inp_g.clone()
+            self.b[0].update(out.g.sum(0))
+
+    def fwd_shard(self, rank, inp, out):
+        s, e = self.bounds[rank]
+        w = self.w[rank].data
+        if self.mode == 'column': out[:, s:e] = torch.addmm(self.b[rank].data, inp, w)
+        else: torch.mm(inp[:, s:e], w, out=out[rank])
+
+    def bwd_shard(self, rank, inp, out_g, grad):
+        s, e = self.bounds[rank]
+        w = self.w[rank]
+        if self.mode == 'column':
+            g = out_g[:, s:e]
+            torch.mm(g, w.data.t(), out=grad[rank])
+            w.update(inp.t() @ g)
+            self.b[rank].update(g.sum(0))
+        else:
+            grad[:, s:e] = out_g @ w.data.t()
+            w.update(inp[:, s:e].t() @ out_g)
+
+    def __repr__(self, t=''):
+        return f"{t+'    '}ShardedLinear({self.in_dim}, {self.num_hidden}, {self.mode}, {self.num_workers})"
\ No newline at end of file
@@ -3,19 +3,64 @@
 # ---------------------------------------------
 # edit notebooks/00_utils.ipynb and run generate_all.py
 
-from fastai import datasets
 import torch
 import gzip
 import pickle
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 from torch import tensor
 import random
 import operator
 import os
+import sys
+import json
+import hashlib
+import inspect
+import types
+import shutil
+import tempfile
+import importlib.util
+import subprocess
+from pathlib import Path
 
 os.environ['KMP_DUPLICATE_LIB_OK']='True'
 
+class LazyModule():
+    def __init__(self, name, on_import=None):
+        '''Module stand-in that imports the module on first attribute access (keeps startup fast).
+            name: full name of the module
+            on_import: function called with the module right after it is imported
+        '''
+        self.name, self.on_import, self.module = name, on_import, None
+
+    def load(self):
+        '''Import the module (only once) and return it.'''
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+            if self.on_import is not None: self.on_import(self.module)
+        return self.module
+
+    def __getattr__(self, attr):
+        module = self.load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # submodules (e.g. PIL.Image) are not always imported by their package
+            try:
+                return importlib.import_module(f'{self.name}.{attr}')
+            except ImportError:
+                # hasattr/getattr with a default keep working on the stand-in
+                raise AttributeError(attr) from None
+
+    def __repr__(self):
+        return f"LazyModule({self.name}, {'loaded' if self.module is not None else 'not loaded'})"
+
+def set_default_cmap(_):
+    '''Grayscale default colormap, applied once matplotlib is imported.'''
+    importlib.import_module('matplotlib').rcParams['image.cmap'] = 'gray'
+
+datasets = LazyModule('fastai.datasets')
+mpl = LazyModule('matplotlib', on_import=set_default_cmap)
+plt = LazyModule('matplotlib.pyplot', on_import=set_default_cmap)
+
 def process_mnist(xt, yt, xv, yv):
     '''Process mnist data with normalization.
         xt: x (input) training data
@@ -29,7 +74,109 @@ def process_mnist(xt, yt, xv, yv):
     xt, xv = normalize(xt, mean, std), normalize(xv, mean, std)
     return xt, yt, xv, yv
 
-mpl.rcParams['image.cmap'] = 'gray'
+cache_dir = Path(os.environ.get('GROUNDUPAI_CACHE', Path.home()/'.groundupai'/'cache'))
+
+def hash_code(md5, code):
+    '''Add the bytecode and constants of a code object (and of the functions defined in it) to an md5 hash.'''
+    md5.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType): hash_code(md5, const)
+        else: md5.update(repr(const).encode())
+
+def code_names(code):
+    '''Global names used by a code object and the functions defined in it.'''
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType): names |= code_names(const)
+    return names
+
+def code_fingerprint(fn):
+    '''Fingerprint of the code of fn and of the functions it calls by global name, defined in the same directory (recursively).
+        Library code and methods called on objects are not covered, changing them does not change the fingerprint.
+        fn: python function
+    '''
+    md5, seen, todo = hashlib.md5(), set(), [fn]
+    directory = Path(fn.__code__.co_filename).parent
+    while todo:
+        f = todo.pop()
+        if f in seen: continue
+        seen.add(f)
+        hash_code(md5, f.__code__)
+        for name in sorted(code_names(f.__code__)):
+            g = f.__globals__.get(name)
+            if inspect.isfunction(g) and Path(g.__code__.co_filename).parent == directory: todo.append(g)
+    return md5.hexdigest()[:10]
+
+def get_cache_path(name, url, fn):
+    '''Cache directory of a dataset downloaded from url and processed by fn (changing the code of fn or of its helpers changes the directory, see code_fingerprint).
+        name: dataset name
+        url: url of the raw dataset
+        fn: processing function of the dataset
+    '''
+    url_hash = hashlib.md5(url.encode()).hexdigest()[:10]
+    return cache_dir/f'{name}-{url_hash}-{fn.__name__}-{code_fingerprint(fn)}'
+
+def source_stamp(source):
+    '''Size and modification time of source file, used to validate the cache.
+        source: path of source (raw data) file
+    '''
+    stat = os.stat(source)
+    return {'source': str(source), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def save_cache(path, source, tensors):
+    '''Save tensors as raw binary files (memory mappable) with a json description.
+        path: cache directory
+        source: path of source (raw data) file
+        tensors: processed tensors
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=path.name + '.tmp', dir=path.parent))
+    meta = {'stamp': source_stamp(source), 'tensors': []}
+    for i, t in enumerate(tensors):
+        t.contiguous().numpy().tofile(str(tmp/f'{i}.bin'))
+        meta['tensors'].append({'dtype': str(t.dtype).split('.')[-1], 'shape': list(t.shape)})
+    with open(tmp/'meta.json', 'w') as f:
+        json.dump(meta, f)
+    # every change of path is a single rename, concurrent readers see no cache or a complete one
+    stale = tmp.with_name(tmp.name + '.stale')
+    try:
+        if path.exists() and (read_meta(path) or {}).get('stamp') != meta['stamp']:
+            try: os.rename(path, stale)
+            except FileNotFoundError: pass
+        try: os.rename(tmp, path)
+        # another writer published the cache first
+        except OSError: pass
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(stale, ignore_errors=True)
+
+def read_meta(path):
+    '''Json description of a cache directory, None if it is missing.
+        path: cache directory
+    '''
+    try:
+        with open(path/'meta.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def load_cache(path, source=None):
+    '''Memory map cached tensors (copy on write), None if cache is missing or source file changed.
+        path: cache directory
+        source: path of source (raw data) file (None for the source recorded in the cache)
+    '''
+    meta = read_meta(path)
+    if meta is None: return None
+    if source is None: source = meta['stamp']['source']
+    if not os.path.exists(source) or meta['stamp'] != source_stamp(source): return None
+
+    tensors = []
+    for i, t in enumerate(meta['tensors']):
+        numel = 1
+        for d in t['shape']: numel *= d
+        data = torch.from_file(str(path/f'{i}.bin'), shared=False, size=numel, dtype=getattr(torch, t['dtype']))
+        tensors.append(data.view(t['shape']))
+    return tuple(tensors)
 
 name2url = {'mnist': 'http://deeplearning.net/data/mnist/mnist.pkl'}
 name2fn = {'mnist': process_mnist}
@@ -38,18 +185,28 @@ def get_mnist_data():
     '''Get mnist dataset.'''
     return get_data('mnist')
 
-def get_data(name):
-    '''Get dataset by name.
+def get_data(name, cache=True):
+    '''Get dataset by name (processed tensors are cached on disk and memory mapped on later calls).
         name: dataset name
+        cache: whether to use the processed dataset cache
     '''
     if name not in name2url or name not in name2fn:
         raise Exception('Unrecognized dataset')
 
+    cache_path = get_cache_path(name, name2url[name], name2fn[name])
+    # checked against the source recorded in the cache, a hit skips fastai and its download check
+    if cache:
+        tensors = load_cache(cache_path)
+        if tensors is not None: return tensors
+
     path = datasets.download_data(name2url[name], ext='.gz')
+
     with gzip.open(path, 'rb') as f:
         ((xt, yt), (xv, yv), _) = pickle.load(f, encoding='latin-1')
 
-    return name2fn[name](xt, yt, xv, yv)
+    tensors = name2fn[name](xt, yt, xv, yv)
+    if cache: save_cache(cache_path, path, tensors)
+    return tensors
 
 def show_random_image(imgs):
     '''Show random image from a batch of images with matplotlib.
@@ -173,4 +330,31 @@ def normalize(x, m=None, s=None):
         m: mean (default to x.mean())
         s: std (default to x.std())
     '''
-    return (x - (m if m else x.mean())) / (s if s else x.std())
\ No newline at end of file
+    return (x - (m if m else x.mean())) / (s if s else x.std())
+
+def import_times(module):
+    '''Import module in a fresh interpreter and measure the import time (in seconds) of every top level module.
+        module: name of the module to be imported
+    '''
+    path = os.path.dirname(importlib.util.find_spec(module).origin)
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=path, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line: continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        # submodules are already counted in the cumulative time of their package
+        if '.' not in name: times[name] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return dict(sorted(times.items(), key=lambda o: o[1][1], reverse=True))
+
+def test_import_time(module, budget, base='torch'):
+    '''Test that the startup time of module stays within budget.
+        module: name of the module to be imported
+        budget: maximum import time in seconds (not counting base)
+        base: package every module needs anyway, excluded from the import time
+    '''
+    times = import_times(module)
+    total = times[module][1] - (times[base][1] if base in times else 0.)
+    report = '\n'.join(f'{name:20} {s:8.3f} {c:8.3f}' for name, (s, c) in list(times.items())[:10])
+    assert total <= budget, f"Import time of {module}: {total:.3f}s > {budget:.3f}s\n{'':20} {'self':>8} {'total':>8}\n{report}"
\ No newline at end of file